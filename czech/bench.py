@@ -0,0 +1,628 @@
+"""Offline benchmarks for the Czech deck build, run against local stand-ins.
+
+Usage: bench.py NAME
+"""
+from typing import Iterator, List
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging as log
+import numpy as np
+
+import srcpath  # makes ../src importable
+import main
+from fetch import Fetcher, make_session
+from httpcache import HTTPCache
+from ratelimit import AdaptiveLimiter, host_of
+from translate import DeepLTranslator, TranslationMemory
+from cardgen import CardGenerator, FakeBackend
+from genanki import Deck, Model, Package
+from words import Definition, WordData
+from dump import Dump, iter_word_lists, read_word_pages
+from sparqldeck import SparqlDeck, qid
+from dedup import dedup_definitions
+from ranks import RankIndex
+from sentindex import SentenceIndex
+import standin
+
+
+def bench_fetch(n_words: int = 200, latency: float = 0.05) -> None:
+    """Scrape a stand-in Wiktionary one page at a time, then with a pool."""
+    results = []
+    with standin.wiktionary(n_words, latency) as server:
+        for workers in (1, 16):
+            start = time.perf_counter()
+            with Fetcher(workers=workers, rate=None) as fetcher:
+                data = main.scrape_wiktionary(1, n_words, server.url, fetcher)
+            elapsed = time.perf_counter() - start
+            # Snapshot the result, in rank order.
+            results.append([(w.word, w.rank, w.defs) for w in data.values()])
+            print(f'{workers:>3} workers: {elapsed:.2f}s, '
+                  f'{n_words / elapsed:.1f} pages/s')
+    assert results[0] == results[1], 'Pooled scrape differs from sequential'
+
+
+def bench_cache(n_words: int = 200, latency: float = 0.05) -> None:
+    """Scrape a stand-in Wiktionary cold, then from the cache, then
+    revalidating everything in the cache."""
+    with standin.wiktionary(n_words, latency) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite')
+        for run, ttl in (('cold', None), ('cached', None), ('refresh', 0)):
+            cache = HTTPCache(path, ttl=ttl)
+            before = server.requests
+            start = time.perf_counter()
+            with Fetcher(workers=16, rate=None, cache=cache) as fetcher:
+                main.scrape_wiktionary(1, n_words, server.url, fetcher)
+            elapsed = time.perf_counter() - start
+            cache.close()
+            print(f'{run:>8}: {elapsed:.2f}s, '
+                  f'{server.requests - before} requests, {cache.stats}')
+
+
+def bench_deepl(n_sentences: int = 1000, latency: float = 0.05) -> None:
+    """Translate sentences with a stand-in DeepL one request per sentence, as
+    before, then in batches."""
+    sentences = [
+        f'Toto je <b>věta</b> číslo {i}, kterou chceme přeložit.'
+        for i in range(n_sentences)
+    ]
+    with standin.deepl(latency) as server:
+        for name, workers, max_texts in (('single', 1, 1), ('batched', 4, 50)):
+            before = server.requests
+            start = time.perf_counter()
+            with Fetcher(workers=workers, rate=None) as fetcher:
+                translator = DeepLTranslator(
+                    'key', fetcher, f'{server.url}/v2/translate',
+                    max_texts=max_texts
+                )
+                translations = translator.translate(sentences)
+            elapsed = time.perf_counter() - start
+            assert translations == [f'[en] {s}' for s in sentences]
+            print(f'{name:>8}: {elapsed:.2f}s, '
+                  f'{server.requests - before} requests')
+
+
+def bench_memory(n_sentences: int = 1000, latency: float = 0.05) -> None:
+    """Translate sentences (a fifth of them repeats, some differing only in
+    whitespace) through the translation memory, twice."""
+    sentences = [
+        f'Toto je <b>věta</b>\xa0číslo {i % (4 * n_sentences // 5)}.'
+        if i % 2 else
+        f'Toto je <b>věta</b> číslo {i % (4 * n_sentences // 5)}.'
+        for i in range(n_sentences)
+    ]
+    with standin.deepl(latency) as server, \
+            tempfile.TemporaryDirectory() as tmp, \
+            Fetcher(workers=4, rate=None) as fetcher:
+        memory = TranslationMemory(os.path.join(tmp, 'tm.sqlite'))
+        translator = DeepLTranslator(
+            'key', fetcher, f'{server.url}/v2/translate', memory=memory
+        )
+        for run in ('first', 'second'):
+            before = server.texts
+            memory.hits = memory.misses = 0
+            start = time.perf_counter()
+            translator.translate(sentences)
+            elapsed = time.perf_counter() - start
+            print(f'{run:>8}: {elapsed:.2f}s, {server.texts - before} texts '
+                  f'sent, {memory.hits} hits, {memory.misses} misses')
+        memory.close()
+
+
+def bench_stream(n_words: int = 50, other_size: int = 20000) -> None:
+    """Parse long multilingual stand-in pages read whole, as before, then as
+    they stream in, counting the connections each opens."""
+
+    def whole(resp):
+        parser = main.WkWordPageHTMLParser()
+        parser.feed(resp.content.decode("utf-8"))
+        return parser.defs
+
+    results = []
+    with standin.wiktionary(n_words, other_size=other_size) as server, \
+            make_session() as session:
+        urls = [f'{server.url}/wiki/slovo{i}' for i in range(n_words)]
+        for name, parse in (('whole', whole), ('stream', main.parse_word_page)):
+            read = 0
+            defs = []
+            connections = server.connections
+            tracemalloc.start()
+            start = time.perf_counter()
+            for url in urls:
+                resp = session.get(url, stream=True)
+                defs.append(parse(resp))
+                read += resp.raw.tell()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(defs)
+            print(f'{name:>7}: {elapsed:.2f}s, {read / 2**20:.1f} MiB read, '
+                  f'peak {peak / 2**20:.1f} MiB, '
+                  f'{server.connections - connections} connections')
+    assert results[0] == results[1], 'Streamed parse differs from whole'
+
+
+def bench_parse(n_pages: int = 1000) -> None:
+    """Parse stand-in word pages in this process, then on pools of worker
+    processes of increasing size."""
+    pages = [
+        standin.wiktionary_word_page(f'slovo{i}', n_defs=5).encode('utf-8')
+        for i in range(n_pages)
+    ]
+    start = time.perf_counter()
+    expected = [main.parse_page_bytes(page) for page in pages]
+    elapsed = time.perf_counter() - start
+    print(f'    serial: {elapsed:.2f}s, {n_pages / elapsed:.0f} pages/s')
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ProcessPoolExecutor(workers) as pool:
+            start = time.perf_counter()
+            defs = list(main.parse_pages(pages, pool))
+            elapsed = time.perf_counter() - start
+        assert defs == expected, 'Pool parse differs from serial'
+        print(f'{workers:>2} procs: {elapsed:.2f}s, '
+              f'{n_pages / elapsed:.0f} pages/s')
+        workers *= 2
+
+
+def bench_parsers(n_words: int = 8, repeats: int = 4) -> None:
+    """Check that parsers give the same results run concurrently on threads,
+    and recycled across pages with `reset`, as run one at a time, on a
+    stand-in list page and word pages."""
+    with standin.wiktionary(n_words) as server, Fetcher(rate=None) as fetcher:
+        base = server.url
+        (page, _) = main.list_pages(1, n_words)[0]
+        list_page = fetcher.get(
+            f'{base}/wiki/P%C5%99%C3%ADloha:Frekven%C4%8Dn%'
+            f'C3%AD_seznam_(%C4%8De%C5%A1tina)/%C4%8CNK_SYN2005/{page}'
+        ).content.decode('utf-8')
+        pages = [
+            resp.content
+            for resp in fetcher.map([f'{base}/wiki/slovo{i}' for i in range(n_words)])
+        ]
+    # Sequentially, with a new parser for every page.
+    parser = main.WkWordListHTMLParser(base)
+    parser.feed(list_page)
+    expected_list = parser.data
+    expected_defs = [main.parse_word_chunks([p]) for p in pages]
+    # Concurrently, with one parser per thread, reset between pages.
+    local = threading.local()
+
+    def parse_list(_):
+        parser = main.WkWordListHTMLParser(base)
+        parser.feed(list_page)
+        return parser.data
+
+    def parse_word(page):
+        if not hasattr(local, 'parser'):
+            local.parser = main.WkWordPageHTMLParser()
+        return main.parse_word_chunks([page], local.parser)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        lists = list(pool.map(parse_list, range(repeats)))
+        defs = list(pool.map(parse_word, pages * repeats))
+    elapsed = time.perf_counter() - start
+    assert len(expected_list) == n_words
+    assert all(data == expected_list for data in lists)
+    # Every parser must have its own data.
+    assert len({id(data) for data in lists}) == repeats
+    assert defs == expected_defs * repeats
+    print(f'{repeats} lists and {len(defs)} pages on 8 threads: {elapsed:.2f}s, '
+          f'same as parsed one at a time')
+
+
+def bench_ranks(n_words: int = 2500, latency: float = 0.05) -> None:
+    """Scrape a range of ranks spanning several list pages, one page after
+    another (as separate passes), then in one pipelined run, and check that
+    they get the same words with the same ranks. The times are about the
+    same: only the few list pages' fetches overlap the word pages'."""
+    with standin.wiktionary(n_words, latency) as server, \
+            Fetcher(workers=16, rate=None) as fetcher:
+        start = time.perf_counter()
+        passes = {}
+        for (page, first_rank) in main.list_pages(1, n_words):
+            words = main.scrape_word_list(page, server.url, fetcher, first_rank)
+            main.scrape_word_pages(words, fetcher)
+            passes.update(words)
+        elapsed = time.perf_counter() - start
+        print(f'  passes: {elapsed:.2f}s')
+        start = time.perf_counter()
+        data = main.scrape_wiktionary(1, n_words, server.url, fetcher)
+        elapsed = time.perf_counter() - start
+        print(f'pipelined: {elapsed:.2f}s')
+    assert [w.rank for w in data.values()] == list(range(1, n_words + 1))
+    assert data == passes, 'Pipelined scrape differs from separate passes'
+
+
+def bench_throttle(n_words: int = 400, max_rate: float = 40) -> None:
+    """Scrape a stand-in Wiktionary that throttles beyond `max_rate` requests
+    a second: giving up on throttled requests after a few retries (as
+    before), then adapting the rate from too fast and from too slow, under a
+    ceiling of 100/s, and under a ceiling of 20/s, below what the stand-in
+    allows, which the rate must never pass."""
+    runs = (
+        # Never told of throttling.
+        ('fixed', 100.0, dict(throttle_retries=0)),
+        ('from fast', 100.0, {}),
+        ('from slow', 100.0, dict(start_rate=5.0)),
+        ('capped', 20.0, dict(start_rate=5.0)),
+    )
+    for (name, rate, kwargs) in runs:
+        with standin.wiktionary(n_words, 0.01, max_rate=max_rate) as server:
+            limiter = AdaptiveLimiter()
+            urls = [f'{server.url}/wiki/slovo{i}' for i in range(n_words)]
+            with Fetcher(
+                workers=16, rate=rate, limiter=limiter, **kwargs
+            ) as fetcher:
+                start = time.perf_counter()
+                try:
+                    done = sum(1 for _ in fetcher.map(urls))
+                except RuntimeError as e:
+                    done = f'aborted ({e})'
+                elapsed = time.perf_counter() - start
+            final = limiter.rate(host_of(server.url))
+            assert final <= rate, f'Rate {final:.0f}/s went past {rate:.0f}/s'
+            print(f'{name:>9}: {elapsed:.2f}s, {done} pages, '
+                  f'{server.throttled} throttled, final rate {final:.0f}/s')
+
+
+def fake_words(n: int) -> Iterator[WordData]:
+    # Made-up words, made as they're needed.
+    for i in range(n):
+        yield WordData(f'slovo{i}', i + 1, f'https://cs.wiktionary.org/wiki/slovo{i}', [
+            Definition(
+                f'slovo{i} význam', [f'word-{i}'], [f'Věta s <b>slovo{i}</b>.'],
+                f'A sentence with <b>word-{i}</b>.',
+            )
+        ])
+
+
+def bench_deck(n_notes: int = 100_000, n_media: int = 1000) -> None:
+    """Write decks of increasing size, with every note in memory before
+    writing (as before), then streaming notes into the writer. Half of the
+    media files are copies of the others."""
+    with tempfile.TemporaryDirectory() as tmp:
+        media = []
+        for i in range(n_media):
+            media.append(os.path.join(tmp, f'{i}.mp3'))
+            with open(media[-1], 'wb') as f:
+                f.write(bytes([i % (n_media // 2) % 256]) * 2048
+                        + str(i % (n_media // 2)).encode())
+        out = os.path.join(tmp, 'deck.apkg')
+        for n in (n_notes // 10, n_notes):
+            for name in ('in memory', 'streamed'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                notes = main.build_notes(fake_words(n))
+                if name == 'in memory':
+                    deck = Deck(8898791874, 'My Refold Czech')
+                    for note in notes:
+                        deck.add_note(note)
+                    Package(deck, media_files=media).write_to_file(out)
+                else:
+                    main.write_deck(out, notes, media)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f'{n:>7} notes {name:>9}: {elapsed:.2f}s, '
+                      f'peak {peak / 2**20:.1f} MiB, '
+                      f'{os.path.getsize(out) / 2**20:.1f} MiB written')
+
+
+def bench_incremental(n_notes: int = 100_000, changed: int = 1000) -> None:
+    """Export a deck in full, then again incrementally after changing a few
+    of its notes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'deck.apkg')
+        for name in ('full', 'unchanged', 'changed'):
+            words = fake_words(n_notes)
+            if name == 'changed':
+                words = (
+                    WordData(w.word, w.rank, w.wk_link + '#fixed', w.defs)
+                    if w.rank <= changed else w
+                    for w in words
+                )
+            start = time.perf_counter()
+            main.write_deck(out, main.build_notes(words), incremental=True)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>9}: {elapsed:.2f}s, '
+                  f'{os.path.getsize(out) / 2**20:.2f} MiB written')
+
+
+def bench_llm(n_words: int = 100, latency: float = 0.2) -> None:
+    """Generate cards for nouns with a fake LLM, one word per request one at a
+    time (as llm-cards.py did), then in concurrent batches, then again from
+    the cache. The fake leaves out some words, which have to be retried."""
+    with open('nouns_batch_prompt.txt') as f:
+        template = f.read()
+    words = [f'slovo{i}' for i in range(n_words)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for (name, batch_size, concurrency) in (
+            ('one by one', 1, 1), ('batched', 25, 4), ('cached', 25, 4),
+        ):
+            backend = FakeBackend(latency, drop=7)
+            # The first two start from scratch; the last reuses the second's.
+            path = os.path.join(tmp, f'{batch_size}.sqlite')
+            generator = CardGenerator(
+                backend, template, path, batch_size=batch_size,
+                max_concurrency=concurrency, requests_per_minute=6000,
+                host=f'fake-{name}',
+            )
+            start = time.perf_counter()
+            data = generator.generate(words)
+            elapsed = time.perf_counter() - start
+            generator.close()
+            print(f'{name:>10}: {elapsed:.2f}s, {backend.calls} requests, '
+                  f'{backend.max_in_flight} at once, '
+                  f'{n_words / elapsed:.0f} words/s')
+            results.append(data)
+    assert len(results[0]) == n_words
+    assert results[0] == results[1] == results[2]
+
+
+def bench_dump(n_words: int = 10_000, other_size: int = 50) -> None:
+    """Read words from a stand-in Wiktionary dump, plain and compressed:
+    index it, then read the words, in this process and on a pool of worker
+    processes."""
+    expected = main.parse_page_bytes(
+        standin.wiktionary_word_page('slovo7', other_size=other_size).encode()
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in ('xml', 'xml.bz2'):
+            path = os.path.join(tmp, f'dump.{ext}')
+            standin.wiktionary_dump(path, n_words, other_size=other_size)
+            index = os.path.join(tmp, f'index-{ext}.sqlite')
+            start = time.perf_counter()
+            Dump(path, index).close()
+            elapsed = time.perf_counter() - start
+            print(f'{ext:>8} index: {os.path.getsize(path) / 2**20:.1f} MiB '
+                  f'in {elapsed:.2f}s')
+            for workers in (0, os.cpu_count() or 1):
+                dump = Dump(path, index)
+                start = time.perf_counter()
+                words = {
+                    word.word: word for word in
+                    iter_word_lists(dump, main.list_pages(1, n_words), 1, n_words)
+                }
+                if workers:
+                    with ProcessPoolExecutor(workers) as pool:
+                        read_word_pages(words, dump, pool)
+                else:
+                    read_word_pages(words, dump)
+                elapsed = time.perf_counter() - start
+                dump.close()
+                assert len(words) == n_words
+                assert words['slovo7'].defs == expected, 'Dump differs from page'
+                print(f'{ext:>8} {workers} procs: {n_words} words in '
+                      f'{elapsed:.2f}s, {n_words / elapsed:.0f} words/s')
+
+
+def bench_sparql(
+    n_rows: int = 50_000, latency: float = 0.2, max_rows: int = 10_000
+) -> None:
+    """Make a deck of every head of state from a stand-in query service
+    that times out on queries for more than `max_rows` results: in one
+    request, then a page at a time, then with pages in flight at once."""
+    model = Model(
+        1318764190,
+        'Head of state',
+        fields=[{'name': 'Name'}, {'name': 'Country'}, {'name': 'From'}],
+        templates=[{
+            'name': 'Country',
+            'qfmt': '{{Name}}',
+            'afmt': '{{FrontSide}}<hr id="answer">{{Country}} ({{From}})',
+        }],
+    )
+    with standin.sparql(standin.heads_of_state(n_rows), latency, max_rows) \
+            as server, tempfile.TemporaryDirectory() as tmp, \
+            Fetcher(workers=8, rate=None, retries=0) as fetcher:
+        for (run, paged, in_flight) in (
+            ('one request', False, 1), ('paged', True, 1), ('concurrent', True, 8)
+        ):
+            heads = SparqlDeck(
+                'SELECT ?item ?name ?country ?start_date WHERE { ... } '
+                'ORDER BY ?item',
+                model,
+                fields={
+                    'Name': 'name',
+                    'Country': 'country',
+                    'From': lambda row: row['start_date'][:4],
+                },
+                guid=lambda row: qid(row['item']),
+                endpoint=f'{server.url}/sparql',
+                page_size=2000,
+                in_flight=in_flight,
+            )
+            out = os.path.join(tmp, 'heads.apkg')
+            before = server.requests
+            # Time it, then run it again to measure the memory it takes
+            # (tracing slows it down).
+            try:
+                for traced in (False, True):
+                    if traced:
+                        tracemalloc.start()
+                    start = time.perf_counter()
+                    with main.DeckWriter(out, Deck(1, 'Heads of state')) as writer:
+                        writer.add_notes(heads.notes(heads.rows(fetcher, paged)))
+                    if traced:
+                        peak = tracemalloc.get_traced_memory()[1]
+                    else:
+                        elapsed = time.perf_counter() - start
+                        requests = server.requests - before
+            except RuntimeError as e:
+                print(f'{run:>11}: failed with {e} after '
+                      f'{time.perf_counter() - start:.2f}s')
+                continue
+            finally:
+                tracemalloc.stop()
+            assert writer.n_notes == n_rows
+            print(f'{run:>11}: {n_rows} notes in {elapsed:.2f}s, '
+                  f'{requests} requests, peak {peak / 2**20:.1f} MiB')
+
+
+def zipf_words(
+    n_words: int, n_defs: int = 3, n_examples: int = 5, max_len: int = 12
+) -> dict:
+    """Made-up words whose example sentences, of 3 to `max_len` words, are
+    drawn from the word list by frequency: mostly common words, and now and
+    then one that isn't in the list at all."""
+    vocabulary = [f'slovo{i}' for i in range(n_words)] + ['neznámé']
+    weights = 1 / np.arange(1, n_words + 2)
+    weights /= weights.sum()
+    rng = np.random.default_rng(1)
+    n_sentences = n_words * n_defs * n_examples
+    lengths = rng.integers(3, max_len + 1, n_sentences)
+    tokens = iter(rng.choice(n_words + 1, lengths.sum(), p=weights))
+    sentences = iter([
+        ' '.join(vocabulary[next(tokens)] for _ in range(n)).capitalize() + '.'
+        for n in lengths
+    ])
+    data = {}
+    for i in range(n_words):
+        defs = [
+            Definition(f'slovo{i} význam', [],
+                       [next(sentences) for _ in range(n_examples)])
+            for _ in range(n_defs)
+        ]
+        data[f'slovo{i}'] = WordData(f'slovo{i}', i + 1, '', defs)
+    return data
+
+
+def bench_examples(n_words: int = 10_000) -> None:
+    """Choose the example sentences for made-up words (see zipf_words):
+    shortest first (as before), then easiest first, scoring a batch of words
+    at a time. Reports how rare the rarest unknown word in each chosen
+    sentence is, on average."""
+    def shortest_first(data):
+        for word in data.values():
+            for d in word.defs:
+                d.examples.sort(key=lambda x: len(x.split()))
+                if d.examples == [] or len(d.examples[0].split()) > 9:
+                    d.examples.insert(0, None)
+
+    ranks = RankIndex(zipf_words(n_words, n_defs=0).values())
+
+    # Score the chosen sentences the same way for both.
+    def mean_score(data):
+        chosen = [(w.rank, d.examples[0]) for w in data.values()
+                  for d in w.defs if d.examples[0] is not None]
+        scores, _ = ranks.score([s for (_, s) in chosen],
+                                np.array([r for (r, _) in chosen]))
+        return len(chosen), scores.mean()
+
+    runs = (
+        ('shortest', shortest_first),
+        ('easiest', lambda data: main.choose_example_sentences(data, ranks)),
+    )
+    for (name, choose) in runs:
+        data = zipf_words(n_words)
+        batches = [dict(list(data.items())[i:i + 1000])
+                   for i in range(0, n_words, 1000)]
+        start = time.perf_counter()
+        for batch in batches:
+            choose(batch)
+        elapsed = time.perf_counter() - start
+        chosen, score = mean_score(data)
+        print(f'{name:>8}: {elapsed:.2f}s, {chosen} sentences chosen, '
+              f'mean rarest unknown rank {score:.0f}')
+
+
+def bench_sentindex(n_words: int = 10_000, n_queries: int = 1000) -> None:
+    """Index the examples of made-up words (see zipf_words), look up short
+    sentences with words drawn at random, and fill in the definitions left
+    without an example from the index."""
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SentenceIndex(os.path.join(tmp, 'sentences.sqlite'))
+        data = zipf_words(n_words, max_len=16)
+        start = time.perf_counter()
+        added = index.add_data(data)
+        elapsed = time.perf_counter() - start
+        print(f'   index: {added} sentences in {elapsed:.2f}s')
+        words = [f'slovo{i}' for i in
+                 np.random.default_rng(2).integers(0, n_words, n_queries)]
+        for ignore_accents in (False, True):
+            times = []
+            for word in words:
+                start = time.perf_counter()
+                index.find(word, ignore_accents=ignore_accents)
+                times.append(time.perf_counter() - start)
+            name = 'folded' if ignore_accents else 'find'
+            print(f'{name:>8}: median {np.median(times) * 1000:.3f}ms, '
+                  f'max {max(times) * 1000:.3f}ms')
+        ranks = RankIndex(data.values())
+        for (name, kwargs) in (('alone', {}), ('borrowed', dict(index=index))):
+            data = zipf_words(n_words, max_len=16)
+            start = time.perf_counter()
+            main.choose_example_sentences(data, ranks, **kwargs)
+            elapsed = time.perf_counter() - start
+            gaps = sum(d.examples[0] is None for w in data.values() for d in w.defs)
+            print(f'{name:>8}: {elapsed:.2f}s, {gaps} definitions without an example')
+        index.close()
+
+
+def bench_dedup(n_words: int = 20_000, dup_rate: float = 0.1) -> None:
+    """Find near-duplicate notes among made-up words (see
+    zipf_words) of increasing number, a tenth of which have a second sense
+    that repeats their first with a word's ending changed."""
+    n = n_words // 8
+    while n <= n_words:
+        data = zipf_words(n, n_examples=2)
+        main.choose_example_sentences(data)
+        rng = np.random.default_rng(4)
+        planted = 0
+        for i in rng.choice(n, int(n * dup_rate), replace=False):
+            (first, second) = data[f'slovo{i}'].defs[:2]
+            if first.examples[0] is None:
+                continue
+            second.definition = first.definition
+            second.examples[0] = first.examples[0].replace('o ', 'a ', 1)
+            planted += 1
+        n_defs = sum(len(word.defs) for word in data.values())
+        start = time.perf_counter()
+        dropped = dedup_definitions(data)
+        elapsed = time.perf_counter() - start
+        assert all(word.defs for word in data.values()), 'A word lost its notes'
+        print(f'{n:>6} words: {elapsed:.2f}s, {dropped} of {n_defs} notes '
+              f'dropped ({planted} planted)')
+        n *= 2
+
+
+BENCHMARKS = {
+    'fetch': bench_fetch,
+    'cache': bench_cache,
+    'deepl': bench_deepl,
+    'memory': bench_memory,
+    'stream': bench_stream,
+    'parse': bench_parse,
+    'parsers': bench_parsers,
+    'ranks': bench_ranks,
+    'llm': bench_llm,
+    'throttle': bench_throttle,
+    'deck': bench_deck,
+    'incremental': bench_incremental,
+    'dump': bench_dump,
+    'sparql': bench_sparql,
+    'examples': bench_examples,
+    'sentindex': bench_sentindex,
+    'dedup': bench_dedup,
+}
+
+
+def run(args: List[str]) -> int:
+    assert len(args) == 2 and args[1] in BENCHMARKS, (
+        f"Usage: bench.py {{{'|'.join(BENCHMARKS)}}}"
+    )
+    BENCHMARKS[args[1]]()
+    return 0
+
+
+if __name__ == "__main__":
+    log.basicConfig(stream=sys.stderr, level=log.WARNING)
+    sys.exit(run(sys.argv))
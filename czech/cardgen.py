@@ -0,0 +1,298 @@
+"""Generate vocabulary cards with an LLM, many words per prompt.
+
+`CardGenerator` splits the words into batches, sends one prompt per batch,
+and runs several prompts at once, within a budget of tokens per minute.
+Requests are paced by the shared adaptive rate limiter, which slows down when
+the model's API throttles us. Each batch's CSV reply is parsed into `WordData`, and each word's
+result is saved as soon as it arrives, so an interrupted run picks up where
+it left off and words already generated are never asked for again.
+
+Any object with an async `ainvoke(prompt)` returning the reply text can be
+the backend. `LangChainBackend` wraps a LangChain chat model, and
+`FakeBackend` answers locally, for testing throughput and batching offline.
+"""
+from typing import Dict, List, Optional, Protocol
+from urllib.parse import quote
+import asyncio
+import csv
+import io
+import json
+import sqlite3
+import time
+import unicodedata
+import logging as log
+
+from words import Data, Definition, WordData
+import srcpath  # makes ../src importable
+from ratelimit import LIMITER, THROTTLE_STATUSES
+
+WIKTIONARY = "https://cs.wiktionary.org"
+# Rough number of characters per token, for budgeting.
+CHARS_PER_TOKEN = 4
+# Rough number of tokens in the reply for each word.
+TOKENS_PER_WORD = 60
+# How many times to retry a throttled request.
+THROTTLE_RETRIES = 10
+# Seconds to pause after a throttled request.
+THROTTLE_PAUSE = 10.0
+
+
+class Backend(Protocol):
+    async def ainvoke(self, prompt: str) -> str:
+        ...
+
+
+class LangChainBackend:
+    """Use a LangChain chat model, like `ChatGoogleGenerativeAI`."""
+
+    def __init__(self, llm) -> None:
+        self.llm = llm
+
+    async def ainvoke(self, prompt: str) -> str:
+        return (await self.llm.ainvoke(prompt)).content
+
+
+class FakeBackend:
+    """Answer prompts locally, after a delay that grows with the length of
+    the reply, with a made-up row for each of the words listed at the end of
+    the prompt. Records the number of calls and the most in flight at once.
+
+    Args:
+        latency (float): Seconds to wait for every call.
+        per_word (float): Extra seconds to wait for each word in the prompt.
+        drop (int): Leave every `drop`th word out of the reply the first time
+            it's asked for, like a real model sometimes does. 0 to never leave
+            words out.
+    """
+
+    def __init__(
+        self, latency: float = 1.0, per_word: float = 0.02, drop: int = 0
+    ) -> None:
+        self.latency = latency
+        self.per_word = per_word
+        self.drop = drop
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.asked = set()
+
+    async def ainvoke(self, prompt: str) -> str:
+        words = prompt.rsplit('\n\n', 1)[-1].split()
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency + self.per_word * len(words))
+        self.in_flight -= 1
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL)
+        for word in words:
+            first = word not in self.asked
+            self.asked.add(word)
+            if first and self.drop and len(self.asked) % self.drop == 0:
+                continue
+            writer.writerow([
+                word, f'{word}-en', 'masculine inanimate',
+                f'hard (goes like {word})', f'Vidím <b>{word}</b>.',
+                f'I see a <b>{word}-en</b>.',
+            ])
+        return '```csv\n' + out.getvalue() + '```'
+
+
+class Budget:
+    """A token bucket for tokens per minute. `spend` waits until it has
+    enough in it."""
+
+    def __init__(self, tokens_per_minute: float) -> None:
+        self.capacity = tokens_per_minute
+        self.level = tokens_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(
+            self.capacity,
+            self.level + self.capacity * (now - self.updated) / 60
+        )
+        self.updated = now
+
+    async def spend(self, tokens: float) -> None:
+        # Don't ask for more than the bucket can ever hold.
+        tokens = min(tokens, self.capacity)
+        # Holding the lock while waiting keeps callers in order.
+        async with self.lock:
+            self._refill()
+            while self.level < tokens:
+                await asyncio.sleep(60 * (tokens - self.level) / self.capacity)
+                self._refill()
+            self.level -= tokens
+
+
+def is_throttled(e: Exception) -> bool:
+    """Whether a backend error is the API asking us to slow down."""
+    # LangChain passes on the status code of the client library's error.
+    status = getattr(e, 'code', None) or getattr(e, 'status_code', None)
+    return status in THROTTLE_STATUSES or 'RESOURCE_EXHAUSTED' in str(e)
+
+
+def parse_rows(reply: str) -> Dict[str, List[str]]:
+    """Parse the CSV rows of a reply, by the normalized noun they're for.
+    Skips anything that isn't a six-column row, like code fences."""
+    rows = {}
+    for row in csv.reader(io.StringIO(reply)):
+        row = [value.strip() for value in row]
+        if len(row) == 6 and row[0]:
+            rows[normalize_word(row[0])] = row
+    return rows
+
+
+def normalize_word(word: str) -> str:
+    return unicodedata.normalize('NFC', word).strip().lower()
+
+
+def row_to_word(row: List[str], rank: int) -> WordData:
+    noun, english, gender, declension, example, example_en = row
+    return WordData(
+        word=noun,
+        rank=rank,
+        wk_link=f"{WIKTIONARY}/wiki/{quote(noun)}",
+        defs=[Definition(
+            definition=f"{gender}; {declension}",
+            english=[english],
+            examples=[example],
+            example_en=example_en,
+        )],
+    )
+
+
+class CardGenerator:
+    """Generate cards for words with an LLM.
+
+    Args:
+        backend (Backend): The model to prompt.
+        template (str): The prompt, with "{words}" where the list of words
+            should go.
+        cache_path (str): SQLite file to keep the generated words in.
+        batch_size (int): Most words to ask for in one prompt.
+        max_concurrency (int): Most prompts in flight at once.
+        requests_per_minute (float): Request rate to start at. The shared rate
+            limiter adjusts it as the API allows.
+        tokens_per_minute (float): Token budget, for prompts and replies.
+        host (str): Which of the rate limiter's hosts requests count against.
+        retries (int): How many times to ask again for words that a reply
+            left out, or whose request failed.
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        template: str,
+        cache_path: str = 'cards.sqlite',
+        batch_size: int = 25,
+        max_concurrency: int = 4,
+        requests_per_minute: float = 10,
+        tokens_per_minute: float = 250_000,
+        retries: int = 3,
+        host: str = 'generativelanguage.googleapis.com',
+    ) -> None:
+        self.backend = backend
+        self.host = host
+        self.template = template
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.retries = retries
+        self.db = sqlite3.connect(cache_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS cards (word TEXT PRIMARY KEY, row TEXT)'
+        )
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _cached(self, word: str) -> Optional[List[str]]:
+        row = self.db.execute(
+            'SELECT row FROM cards WHERE word = ?', (normalize_word(word),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, rows: Dict[str, List[str]]) -> None:
+        self.db.executemany(
+            'INSERT OR REPLACE INTO cards VALUES (?, ?)',
+            [(w, json.dumps(row, ensure_ascii=False)) for (w, row) in rows.items()]
+        )
+        self.db.commit()
+
+    async def _run_batch(
+        self,
+        batch: List[str],
+        budget: Budget,
+        slots: asyncio.Semaphore,
+    ) -> Dict[str, List[str]]:
+        prompt = self.template.replace('{words}', '\n'.join(batch))
+        tokens = len(prompt) / CHARS_PER_TOKEN + TOKENS_PER_WORD * len(batch)
+        async with slots:
+            await budget.spend(tokens)
+            for _ in range(THROTTLE_RETRIES + 1):
+                # The quota is a ceiling, too.
+                rate = self.requests_per_minute / 60
+                await asyncio.sleep(LIMITER.delay(self.host, rate, rate))
+                try:
+                    reply = await self.backend.ainvoke(prompt)
+                except Exception as e:
+                    if is_throttled(e):
+                        LIMITER.throttled(self.host, THROTTLE_PAUSE)
+                        continue
+                    log.warning(f'Batch of {len(batch)} words failed: {e}')
+                    return {}
+                LIMITER.succeeded(self.host)
+                break
+            else:
+                log.warning(f'Batch of {len(batch)} words throttled, giving up')
+                return {}
+        wanted = {normalize_word(word) for word in batch}
+        rows = {w: row for (w, row) in parse_rows(reply).items() if w in wanted}
+        # Checkpoint as soon as each batch is in.
+        self._save(rows)
+        return rows
+
+    async def agenerate(self, words: List[str]) -> Data:
+        """Generate cards for the words, ranked in the order given. Words that
+        still aren't generated after all the retries are left out."""
+        rows = {}
+        todo = []
+        for word in words:
+            row = self._cached(word)
+            if row is None:
+                todo.append(word)
+            else:
+                rows[normalize_word(word)] = row
+        log.info(f'{len(rows)} of {len(words)} words already generated')
+        budget = Budget(self.tokens_per_minute)
+        slots = asyncio.Semaphore(self.max_concurrency)
+        for attempt in range(self.retries + 1):
+            if not todo:
+                break
+            batches = [
+                todo[i:i + self.batch_size]
+                for i in range(0, len(todo), self.batch_size)
+            ]
+            for result in await asyncio.gather(*(
+                self._run_batch(batch, budget, slots) for batch in batches
+            )):
+                rows.update(result)
+            todo = [w for w in todo if normalize_word(w) not in rows]
+            if todo:
+                log.info(f'{len(todo)} words missing after attempt {attempt + 1}')
+        if todo:
+            log.warning(f'Gave up on {len(todo)} words: {todo}')
+        data = {}
+        for (rank, word) in enumerate(words, start=1):
+            row = rows.get(normalize_word(word))
+            if row is not None and word not in data:
+                data[word] = row_to_word(row, rank)
+        return data
+
+    def generate(self, words: List[str]) -> Data:
+        return asyncio.run(self.agenerate(words))
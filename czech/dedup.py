@@ -0,0 +1,164 @@
+"""Find the near-duplicate definitions among the scraped words.
+
+Wiktionary often repeats a definition and its example almost word for word
+across a word's senses. Each definition would make a note, and its example
+be sent to DeepL, so the repeats are dropped before the translations and
+notes are made.
+
+Examples are never given another example's translation for being similar:
+changing one letter ("šli" to "nešli") can reverse the meaning. Only exactly
+the same sentences share a translation, through the translation memory.
+
+Texts are compared by the sets of character 4-grams in them, with MinHash:
+each text gets a signature of `HASHES` minimum hashes of its 4-grams, and the
+fraction of two signatures that agree estimates how much the sets overlap
+(their Jaccard similarity). Locality-sensitive hashing then puts texts with a
+band of their signature in common into the same bucket, and only texts in a
+bucket together are compared, so the work grows linearly with the number of
+texts, rather than with the number of pairs. Texts found to be at least
+`THRESHOLD` similar are joined into groups with union-find.
+
+Hashing the 4-grams and computing the signatures is done with NumPy, over
+all the texts at once.
+"""
+from typing import List, Sequence
+import logging as log
+import numpy as np
+
+from translate import normalize
+from words import Data, Definition
+
+K = 4
+HASHES = 64
+# LSH bands of ROWS hashes each. Texts over about (1 / BANDS) ** (1 / ROWS)
+# similar (0.5 here) are likely to share a band.
+BANDS = 16
+ROWS = HASHES // BANDS
+THRESHOLD = 0.8
+# How many of the texts' 4-grams to hash at a time.
+CHUNK_SIZE = 2**16
+
+_rng = np.random.default_rng(3923034357)
+# Multiply-shift hash functions: (a * x + b) >> 32, wrapping at 64 bits.
+A = _rng.integers(1, 2**63, HASHES, dtype=np.uint64) | np.uint64(1)
+B = _rng.integers(0, 2**63, HASHES, dtype=np.uint64)
+# Multipliers to roll a band's hashes into a single key.
+BAND_KEY = _rng.integers(1, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+
+class UnionFind:
+    """Disjoint sets of the numbers 0 to n - 1. Each set is named by its
+    smallest member."""
+
+    def __init__(self, n: int) -> None:
+        self.parent = np.arange(n)
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            # Halve the path on the way up.
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return int(i)
+
+    def union(self, i: int, j: int) -> None:
+        (i, j) = (self.find(i), self.find(j))
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+    def roots(self) -> np.ndarray:
+        """The set each number is in."""
+        return np.array([self.find(i) for i in range(len(self.parent))], int)
+
+
+def shingle_hashes(texts: Sequence[str]) -> List[np.ndarray]:
+    """The 32-bit hashes of each text's character 4-grams, computed on all
+    the texts' characters at once."""
+    # Pad each text, so that short ones have a 4-gram too, and so that no
+    # 4-gram spans two texts. Markup is compared too, so examples with
+    # different words in bold stay apart.
+    padded = [f" {normalize(text).lower()} ".ljust(K) for text in texts]
+    chars = np.frombuffer("".join(padded).encode("utf-32-le"), np.uint32)
+    chars = chars.astype(np.uint64)
+    # A polynomial hash of each run of K characters.
+    hashes = np.zeros(len(chars) - K + 1, np.uint64)
+    for i in range(K):
+        hashes = hashes * np.uint64(1_000_003) + chars[i:len(chars) - K + 1 + i]
+    hashes = (hashes ^ (hashes >> np.uint64(32))).astype(np.uint32)
+    ends = np.cumsum([len(text) for text in padded])
+    starts = ends - [len(text) for text in padded]
+    return [hashes[start:end - K + 1] for (start, end) in zip(starts, ends)]
+
+
+def signatures(texts: Sequence[str]) -> np.ndarray:
+    """The MinHash signature of each text, one row per text."""
+    shingles = shingle_hashes(texts)
+    sigs = np.empty((len(texts), HASHES), np.uint32)
+    first = 0
+    while first < len(texts):
+        # Take texts until there are enough 4-grams for a chunk.
+        last = first
+        size = 0
+        while last < len(texts) and (
+            size == 0 or size + len(shingles[last]) <= CHUNK_SIZE
+        ):
+            size += len(shingles[last])
+            last += 1
+        x = np.concatenate(shingles[first:last]).astype(np.uint64)
+        hashed = (A[:, None] * x + B[:, None]) >> np.uint64(32)
+        counts = [len(s) for s in shingles[first:last]]
+        starts = np.cumsum(counts) - counts
+        sigs[first:last] = np.minimum.reduceat(hashed, starts, axis=1).T
+        first = last
+    return sigs
+
+
+def groups(texts: Sequence[str], threshold: float = THRESHOLD) -> np.ndarray:
+    """Group the texts that are near-duplicates. Returns, for each text, the
+    index of the first text in its group."""
+    sets = UnionFind(len(texts))
+    if len(texts) < 2:
+        return sets.roots()
+    sigs = signatures(texts)
+    for band in range(BANDS):
+        rows = sigs[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64)
+        keys = (rows * BAND_KEY).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Compare each text with the first in its bucket.
+        new_bucket = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        firsts = order[np.maximum.accumulate(
+            np.where(new_bucket, np.arange(len(order)), 0)
+        )]
+        candidates = firsts != order
+        (i, j) = (order[candidates], firsts[candidates])
+        similar = (sigs[i] == sigs[j]).mean(axis=1) >= threshold
+        for (a, b) in zip(i[similar], j[similar]):
+            sets.union(a, b)
+    return sets.roots()
+
+
+def note_text(word: str, d: Definition) -> str:
+    """What a definition's note shows, for comparing notes. The word is part
+    of it: two words with the same definition are still two cards."""
+    return f"{word}\n{d.definition}\n{d.examples[0] or ''}"
+
+
+def dedup_definitions(data: Data) -> int:
+    """Drop each definition whose note would be a near-duplicate of an
+    earlier one's (going by rank), in place. A word always keeps at least
+    one definition. Returns how many were dropped."""
+    defs = [(word, d) for word in data.values() for d in word.defs]
+    roots = groups([note_text(word.word, d) for (word, d) in defs])
+    drop = {id(d) for (i, (_, d)) in enumerate(defs) if roots[i] != i}
+    dropped = 0
+    for word in data.values():
+        kept = [d for d in word.defs if id(d) not in drop]
+        if not kept and word.defs:
+            # Keep the word's card, even if it's like another word's.
+            kept = word.defs[:1]
+        dropped += len(word.defs) - len(kept)
+        word.defs = kept
+    log.info(f"Dropped {dropped} near-duplicate definitions of {len(defs)}")
+    return dropped
+
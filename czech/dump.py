@@ -0,0 +1,330 @@
+"""Read the word data from a local cs.wiktionary dump, instead of the site.
+
+Wikimedia publishes the wikitext of every page in pages-articles XML dumps
+(https://dumps.wikimedia.org/cswiktionary/). `Dump` reads one, plain or
+compressed with bz2 or gzip, and gets the same `WordData` and `Definition`s
+out of it as scraping the pages does, without any requests.
+
+The first time a dump is used, one pass over it indexes where each page is,
+by title, into SQLite. After that, a word's page is read straight from its
+offset: a plain dump is mapped into memory, so any page can be read at once,
+while a compressed one has to be decompressed up to the page, so its pages
+are read in the order they come in the dump. (Decompress a dump once, e.g.
+with `bunzip2 -k`, if it's going to be read many times.) The wikitext is
+parsed on a pool of worker processes.
+"""
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import Executor
+from urllib.parse import quote
+import bz2
+import gzip
+import html
+import mmap
+import os
+import re
+import sqlite3
+import logging as log
+
+from words import Data, Definition, WordData
+
+# The title of each page of the ČNK SYN2005 frequency list, given its ranks.
+LIST_TITLE = "Příloha:Frekvenční seznam (čeština)/ČNK SYN2005/{page}"
+# How much of the dump to scan for pages at a time while indexing.
+SCAN_BLOCK_SIZE = 4 * 2**20
+# How many pages to send to a parsing process at a time.
+PARSE_CHUNK_SIZE = 16
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dump (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    title TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+'''
+
+PAGE = re.compile(rb"<page>.*?<title>(.*?)</title>.*?</page>", re.S)
+TEXT = re.compile(rb"<text[^>]*>(.*?)</text>", re.S)
+HEADING = re.compile(r"^(=+)\s*(.*?)\s*\1\s*$", re.M)
+TEMPLATE = re.compile(r"\{\{[^{}]*\}\}")
+LINK = re.compile(r"\[\[(?:[^|\]]*\|)?([^\]]*)\]\]")
+LIST_LINK = re.compile(r"\[\[([^|\]]+)(?:\|[^\]]*)?\]\]")
+BOLD = re.compile(r"'''(.*?)'''")
+REMOVE = re.compile(r"<!--.*?-->|<ref[^>]*/>|<ref[^>]*>.*?</ref>", re.S)
+TRANSLATION = re.compile(r"\{\{P\|en\|([^|}]+)")
+
+
+def compression(path: str) -> Optional[str]:
+    """How the dump at `path` is compressed ("bz2" or "gzip"), if it is."""
+    with open(path, "rb") as f:
+        magic = f.read(3)
+    if magic == b"BZh":
+        return "bz2"
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    return None
+
+
+def open_dump(path: str) -> IO[bytes]:
+    """Open a dump, decompressing it if it's compressed."""
+    return {"bz2": bz2.open, "gzip": gzip.open}.get(compression(path), open)(
+        path, "rb"
+    )
+
+
+def scan_pages(f: IO[bytes]) -> Iterator[Tuple[str, int, int]]:
+    """The title, offset and length of each page in the dump `f`, in one
+    pass over it. Offsets are into the decompressed XML."""
+    buffer = b""
+    # The offset of the start of the buffer.
+    base = 0
+    while True:
+        block = f.read(SCAN_BLOCK_SIZE)
+        if not block:
+            break
+        buffer += block
+        end = 0
+        for m in PAGE.finditer(buffer):
+            title = html.unescape(m.group(1).decode("utf-8"))
+            yield title, base + m.start(), m.end() - m.start()
+            end = m.end()
+        # Keep the page that's still coming in.
+        start = buffer.find(b"<page>", end)
+        cut = start if start >= 0 else max(end, len(buffer) - len(b"<page>"))
+        base += cut
+        buffer = buffer[cut:]
+
+
+class Dump:
+    """A cs.wiktionary pages-articles dump, and the index of its pages.
+
+    Args:
+        path (str): The dump: .xml, .xml.bz2 or .xml.gz.
+        index (str): Where to keep the index of the dump's pages. It's
+            rebuilt if the dump changes.
+        base (str): The site the words' links go to.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index: str = "dump-index.sqlite",
+        base: str = "https://cs.wiktionary.org",
+    ) -> None:
+        self.path = path
+        self.base = base
+        self.db = sqlite3.connect(index)
+        self.db.executescript(SCHEMA)
+        stat = os.stat(path)
+        # Which dump this is: a newer dump has another size or mtime.
+        self.key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if self.db.execute("SELECT path, size, mtime FROM dump").fetchone() != self.key:
+            self._build_index(self.key)
+        self.file = open_dump(path)
+        # A plain dump is mapped, so that any page can be read directly.
+        self.map = None
+        if compression(path) is None:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+        self.db.close()
+
+    def _build_index(self, key: Tuple[str, int, float]) -> None:
+        log.info(f"Indexing the pages of {self.path}")
+        with self.db:
+            self.db.execute("DELETE FROM dump")
+            self.db.execute("DELETE FROM pages")
+            with open_dump(self.path) as f:
+                # A title seen twice keeps its first page.
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO pages VALUES (?, ?, ?)", scan_pages(f)
+                )
+            self.db.execute("INSERT INTO dump VALUES (?, ?, ?)", key)
+        (n,) = self.db.execute("SELECT COUNT(*) FROM pages").fetchone()
+        log.info(f"Indexed {n} pages")
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def __contains__(self, title) -> bool:
+        return self._locate(title) is not None
+
+    def _locate(self, title: str) -> Optional[Tuple[int, int]]:
+        return self.db.execute(
+            "SELECT offset, length FROM pages WHERE title = ?", (title,)
+        ).fetchone()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self.map is not None:
+            return self.map[offset:offset + length]
+        # A compressed dump can only be read forwards; going back means
+        # decompressing it from the start again.
+        if offset < self.file.tell():
+            self.file.close()
+            self.file = open_dump(self.path)
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def pages(self, titles: Iterable[str]) -> Dict[str, bytes]:
+        """The XML of the pages with these titles, if they're in the dump.
+        The pages are read in the order they come in the dump."""
+        found = []
+        for title in titles:
+            location = self._locate(title)
+            if location is not None:
+                found.append((location, title))
+        found.sort()
+        return {title: self._read(*location) for (location, title) in found}
+
+    def page_text(self, title: str) -> Optional[str]:
+        """The wikitext of the page with this title, if it's in the dump."""
+        page = self.pages([title]).get(title)
+        return None if page is None else page_wikitext(page)
+
+    def link(self, title: str) -> str:
+        """The URL of the page with this title."""
+        return f"{self.base}/wiki/{quote(title.replace(' ', '_'))}"
+
+
+def page_wikitext(page: bytes) -> str:
+    """The wikitext in a page's XML."""
+    m = TEXT.search(page)
+    return html.unescape(m.group(1).decode("utf-8")) if m else ""
+
+
+def clean_wikitext(text: str) -> str:
+    """Wikitext reduced to the text it shows, keeping bold as <b> tags.
+    Templates (labels, citations) are left out."""
+    text = REMOVE.sub("", text)
+    # Templates can be nested, so take them out from the inside.
+    while True:
+        text, n = TEMPLATE.subn("", text)
+        if n == 0:
+            break
+    text = LINK.sub(r"\1", text)
+    text = BOLD.sub(r"<b>\1</b>", text)
+    return " ".join(text.replace("''", "").split())
+
+
+def czech_section(text: str) -> str:
+    """The part of a page's wikitext about the Czech word."""
+    start = None
+    for m in HEADING.finditer(text):
+        if len(m.group(1)) != 2:
+            continue
+        if start is not None:
+            return text[start:m.start()]
+        if m.group(2) == "čeština":
+            start = m.end()
+    return "" if start is None else text[start:]
+
+
+def parse_wikitext(text: str) -> List[Definition]:
+    """The definitions and their examples and English translations on a
+    word's page, from its wikitext, like `parse_word_chunks` gets them from
+    its HTML."""
+    section = czech_section(text)
+    defs: List[Definition] = []
+    # Keep track of the definition the next translation goes with.
+    def_no = -1
+    headings = list(HEADING.finditer(section))
+    for (i, heading) in enumerate(headings):
+        end = headings[i + 1].start() if i + 1 < len(headings) else len(section)
+        body = section[heading.end():end]
+        name = heading.group(2)
+        if name == "význam":
+            # The translations count from the first of these definitions.
+            def_no = len(defs) - 1
+            for line in body.splitlines():
+                if line.startswith("#*") and not line.startswith("#*:"):
+                    # An example of the last definition.
+                    if defs:
+                        defs[-1].examples.append(clean_wikitext(line[2:]))
+                elif line.startswith("#") and not line.startswith(("#:", "#*")):
+                    defs.append(Definition(
+                        definition=clean_wikitext(line[1:]),
+                        # to be filled in later:
+                        examples=[],
+                        english=[],
+                    ))
+        elif name == "překlady":
+            # One {{Překlady}} per definition, in order.
+            for block in body.split("{{Překlady")[1:]:
+                def_no += 1
+                if def_no < len(defs):
+                    defs[def_no].english.extend(
+                        m.group(1).strip() for m in TRANSLATION.finditer(block)
+                    )
+    return defs
+
+
+def parse_page_xml(page: bytes) -> List[Definition]:
+    """Parse a word's page from the dump. Run in the worker processes of the
+    parsing pool."""
+    return parse_wikitext(page_wikitext(page))
+
+
+def parse_list_wikitext(text: str, first_rank: int, dump: Dump) -> Data:
+    """The words on a page of the frequency list, without their
+    definitions. Only the links after the first heading are words."""
+    heading = HEADING.search(text)
+    if heading is not None:
+        text = text[heading.end():]
+    data = {}
+    rank = first_rank
+    for m in LIST_LINK.finditer(text):
+        word = m.group(1).strip()
+        if ":" in word:
+            continue
+        data.setdefault(word, WordData(
+            word=word,
+            rank=rank,
+            wk_link=dump.link(word),
+            # to be filled in later:
+            defs=[],
+        ))
+        rank += 1
+    return data
+
+
+def iter_word_lists(
+    dump: Dump, pages: Iterable[Tuple[str, int]], first: int, last: int
+) -> Iterator[WordData]:
+    """Yield the words ranked `first` to `last`, in rank order, from the
+    frequency list pages (named like main.list_pages names them) in the
+    dump. A word that appears again on a later page keeps its first rank."""
+    seen = set()
+    for (page, first_rank) in pages:
+        text = dump.page_text(LIST_TITLE.format(page=page))
+        if text is None:
+            raise KeyError(f"No frequency list page {page} in {dump.path}")
+        for word in parse_list_wikitext(text, first_rank, dump).values():
+            if first <= word.rank <= last and word.word not in seen:
+                seen.add(word.word)
+                yield word
+
+
+def read_word_pages(
+    words: Data, dump: Dump, pool: Optional[Executor] = None
+) -> None:
+    """Fill in the definitions of each word from its page in the dump, in
+    place, like `scrape_word_pages` does from the site. The pages are parsed
+    on `pool`, if given. Words with no page get no definitions."""
+    pages = dump.pages(words)
+    missing = len(words) - len(pages)
+    if missing:
+        log.warning(f"{missing} of {len(words)} words have no page in the dump")
+    titles = list(pages)
+    if pool is None:
+        defs = map(parse_page_xml, pages.values())
+    else:
+        defs = pool.map(parse_page_xml, pages.values(), chunksize=PARSE_CHUNK_SIZE)
+    for (title, word_defs) in zip(titles, defs):
+        words[title].defs = word_defs
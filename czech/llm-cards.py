@@ -1,19 +1,61 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.rate_limiters import InMemoryRateLimiter
+"""Make a deck of Czech noun cards with Gemini.
 
-with open("czech/google-genai.apikey") as f:
-    apikey = f.read()
+Usage: llm-cards.py WORDS OUTPUT [--fake]
 
-rate_limiter = InMemoryRateLimiter(
-    requests_per_second=0.1,  # <-- Super slow! We can only make a request once every 10 seconds!!
-    check_every_n_seconds=0.1,  # Wake up every 100 ms to check whether allowed to make a request,
-    max_bucket_size=10,  # Controls the maximum burst size.
-)
+WORDS has one noun per line, most common first. Generated cards are kept in
+cards.sqlite, so a run that's interrupted (or that some words failed in) can
+just be run again. --fake uses a local stand-in for the model instead.
+"""
+from typing import List
+import os
+import sys
+import logging as log
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", api_key=apikey, rate_limiter=rate_limiter
-)
+import main
+from cardgen import CardGenerator, FakeBackend, LangChainBackend
 
-# Simple text invocation
-result = llm.invoke("Sing a ballad of LangChain.")
-print(result.content)
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The generated cards' own deck and note type (randomly generated IDs), and a
+# namespace for their GUIDs, so that they don't merge with the scraped deck's
+# notes for the same words when both are imported.
+DECK_ID = 1437628200
+MODEL_ID = 1345452928
+GUID_NAMESPACE = "llm-nouns"
+
+
+def make_backend(fake: bool):
+    if fake:
+        return FakeBackend()
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    with open(os.path.join(HERE, "google-genai.apikey")) as f:
+        apikey = f.read().strip()
+    # No rate limiter here: CardGenerator paces requests with the shared
+    # adaptive limiter, with several requests in flight at once.
+    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", api_key=apikey)
+    return LangChainBackend(llm)
+
+
+def run(args: List[str]) -> int:
+    usage = "Usage: llm-cards.py WORDS OUTPUT [--fake]"
+    assert len(args) in (3, 4), usage
+    fake = args[3:] == ["--fake"]
+    assert len(args) == 3 or fake, usage
+    with open(args[1]) as f:
+        words = [line.strip() for line in f if line.strip()]
+    with open(os.path.join(HERE, "nouns_batch_prompt.txt")) as f:
+        template = f.read()
+    generator = CardGenerator(make_backend(fake), template)
+    data = generator.generate(words)
+    generator.close()
+    log.info(f"Generated cards for {len(data)} of {len(words)} words")
+    model = main.make_model(MODEL_ID, "Czech Noun (LLM)")
+    notes = main.build_notes(data, model, guid_namespace=GUID_NAMESPACE)
+    main.write_deck(
+        args[2], notes, deck_id=DECK_ID, deck_name="Czech Nouns (LLM)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    log.basicConfig(stream=sys.stdout, level=log.INFO)
+    sys.exit(run(sys.argv))
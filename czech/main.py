@@ -1,39 +1,72 @@
-from typing import List, Dict
-from genanki import Deck, Note, Model, Package
+from typing import Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from genanki import Deck, Note, Model, guid_for
 import requests
-import pickle
+import codecs
 import logging as log
+import os
+import sys
 from html.parser import HTMLParser
-from dataclasses import dataclass
 from tqdm import tqdm
+import numpy as np
+
+import srcpath  # makes ../src importable
+from deckwriter import DeckWriter, manifest_for
+from dump import Dump, iter_word_lists as iter_dump_word_lists, read_word_pages
+from fetch import Fetcher
+from httpcache import HTTPCache, TTL
+from words import Definition, WordData, Data
+from pipeline import Pipeline, Stage
+from dedup import dedup_definitions
+from ranks import RankIndex
+from sentindex import SentenceIndex, highlight, plain
+from store import WordStore
+from translate import DeepLTranslator, TranslationMemory, load_api_key, normalize
+from tts import TTS, audio_files
+
+# Where to find Wiktionary. Overridden to point at a local stand-in when
+# benchmarking.
+WIKTIONARY = "https://cs.wiktionary.org"
+# How many words there are on each page of the frequency list.
+LIST_PAGE_SIZE = 1000
+# How much of a word page to read at a time.
+PAGE_CHUNK_SIZE = 16 * 1024
+# How much of the rest of a streamed word page to read, once it's parsed,
+# to keep its connection alive for the next.
+MAX_DRAIN_SIZE = 1024 * 1024
+# How many pages to send to a parsing process at a time.
+PARSE_CHUNK_SIZE = 8
 
 
-@dataclass
-class Definition:
-    definition: str
-    english: List[str]       # the English word translations
-    examples: List[str]      # The example sentences
-    example_en: str = None   # The example in English
-    audio: str = None        # The audio file name
-
-@dataclass
-class WordData:
-    word: str                   # the root word
-    rank: int                   # its frequency rank
-    wk_link: str                # url for its Wiktionary page
-    defs: List[Definition]      # list of definitions and usage examples
-
-# Mapping from word to word data
-Data = Dict[str, WordData]
+class WkWordListHTMLParser(HTMLParser):
+    """Parse a page of the frequency list. All the parsing state is kept on
+    the instance, so parsers can run concurrently, and `reset` readies one for
+    another page."""
+
+    def __init__(
+        self,
+        base: str = WIKTIONARY,
+        first_rank: int = 1,
+        *,
+        convert_charrefs: bool = True
+    ) -> None:
+        # The site that the word links are relative to.
+        self.base = base
+        # The rank of the first word on the page.
+        self.first_rank = first_rank
+        super().__init__(convert_charrefs=convert_charrefs)
 
+    def reset(self) -> None:
+        super().reset()
+        # Have we got to the words yet?
+        self.in_words = False
+        # The data collected so far. This is a new dict, so that data from
+        # an earlier page isn't touched.
+        self.data = {}
+        # Keep track of the rank of the current word.
+        self.wordrank = self.first_rank
 
-class WkWordListHTMLParser(HTMLParser):
-    # Have we got to the words yet?
-    in_words = False
-    # The data collected so far.
-    data = {}
-    # Keep track of the rank of the current word.
-    wordrank = 1
     # Handle the HTML tags.
     def handle_starttag(self, tag, attrs):
         if self.in_words:
@@ -44,7 +77,7 @@ class WkWordListHTMLParser(HTMLParser):
                 self.data[word] = WordData(
                     word = word,
                     rank = self.wordrank,
-                    wk_link = f"https://cs.wiktionary.org{attrs['href']}",
+                    wk_link = f"{self.base}{attrs['href']}",
                     # to be filled in later:
                     defs = []
                 )
@@ -63,25 +96,31 @@ class WkWordListHTMLParser(HTMLParser):
 
 
 class WkWordPageHTMLParser(HTMLParser):
-    # the id of a given section
-    current_section = None
-    # Are we in the list of examples?
-    in_examples = False
-    # Are we building a definition or example out of parts?
-    process_line = False
-    # Hold the definition or example so far -- as we're building it.
-    text = ""
-    # Keep track of the definition that the current translation goes with.
-    def_no = -1
-    # Are we collecting translations?
-    collect_trans = False
-    # Keeping track of language
-    is_h2 = False
-    is_czech = False
-
-    def __init__(self, *, convert_charrefs: bool = True) -> None:
-        super().__init__(convert_charrefs=convert_charrefs)
-        # Track the definitions we've found.
+    """Parse a word page. All the parsing state is kept on the instance, so
+    parsers can run concurrently, and `reset` readies one for another
+    page."""
+
+    def reset(self) -> None:
+        super().reset()
+        # the id of a given section
+        self.current_section = None
+        # Are we in the list of examples?
+        self.in_examples = False
+        # Are we building a definition or example out of parts?
+        self.process_line = False
+        # Hold the definition or example so far -- as we're building it.
+        self.text = ""
+        # Keep track of the definition that the current translation goes with.
+        self.def_no = -1
+        # Are we collecting translations?
+        self.collect_trans = False
+        # Keeping track of language
+        self.is_h2 = False
+        self.is_czech = False
+        # Have we got past the end of the section on Czech?
+        self.czech_done = False
+        # Track the definitions we've found. This is a new list, so that the
+        # definitions from an earlier page aren't touched.
         self.defs = []
 
     def _sort_current_section(self, id):
@@ -97,6 +136,9 @@ class WkWordPageHTMLParser(HTMLParser):
         attrs = dict(attrs)
         # Until we get to the section on Czech, ignore everything.
         if tag == "h2":
+            if self.is_czech:
+                # The next language's section: we're done with Czech.
+                self.czech_done = True
             self.is_h2 = True
             self.is_czech = False
             return
@@ -206,139 +248,502 @@ class WkWordPageHTMLParser(HTMLParser):
             # Found the end of the current section.
             self.current_section = None
 
+def parse_word_chunks(
+    chunks: Iterable[bytes], parser: Optional[WkWordPageHTMLParser] = None
+) -> List[Definition]:
+    """Parse a word page a chunk of bytes at a time, and stop once we're past
+    the section on Czech. Reuses `parser`, if given."""
+    if parser is None:
+        parser = WkWordPageHTMLParser()
+    else:
+        parser.reset()
+    # Chunks can end part way through a character, so decode incrementally.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        if parser.czech_done:
+            break
+    else:
+        parser.feed(decoder.decode(b"", final=True))
+    return parser.defs
+
+
+def parse_word_page(resp: requests.Response) -> List[Definition]:
+    """Parse a word page as it's read from the response, and stop parsing
+    once we're past the section on Czech.
+
+    The rest of the page is still read (and thrown away), up to
+    MAX_DRAIN_SIZE, since closing a response part way through closes its
+    connection too: the next request would have to open another, with
+    another TLS handshake. Only the rest of a page bigger than that is
+    left unread, where dropping the connection costs less than reading on.
+    """
+    with resp:
+        chunks = resp.iter_content(PAGE_CHUNK_SIZE)
+        defs = parse_word_chunks(chunks)
+        drained = 0
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > MAX_DRAIN_SIZE:
+                break
+    return defs
+
+
+# Each worker process of the parsing pool recycles one parser.
+_worker_parser = None
+
+
+def parse_page_bytes(page: bytes) -> List[Definition]:
+    """Parse a word page that has already been read. Run in the worker
+    processes of the parsing pool."""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = WkWordPageHTMLParser()
+    return parse_word_chunks(
+        (page[i:i + PAGE_CHUNK_SIZE]
+         for i in range(0, len(page), PAGE_CHUNK_SIZE)),
+        _worker_parser
+    )
+
+
+def parse_pages(
+    pages: Iterable[bytes], pool: Executor
+) -> Iterator[List[Definition]]:
+    """Parse word pages on a pool of worker processes, yielding their
+    definitions in the same order as the pages."""
+    # Send the pages over in chunks to cut down on the overheads.
+    return pool.map(parse_page_bytes, pages, chunksize=PARSE_CHUNK_SIZE)
+
+
 def test_parse():
     url = "https://cs.wiktionary.org/wiki/a"
-    resp = requests.get(url)
-    parser = WkWordPageHTMLParser()
-    parser.feed(resp.content.decode("utf-8"))
-    return parser.defs
+    with Fetcher(workers=1) as fetcher:
+        return parse_word_page(fetcher.get(url, cached=False, stream=True))
 
 
 def main(args: List[str]) -> int:
-    assert len(args) == 2, "Usage: main OUTPUT"
-    out = args[1]
-    # Get the words, definitions, and examples from Wiktionary
-    data = scrape_wiktionary("1-1000")
-    # Reorder the example sentences in-place so that the one we want to
-    # make a card with comes first.
-    choose_example_sentences(data)
-    # Get translations from DeepL
-    get_translations(data)
-    # Get TTS.
-    get_tts(data)
-    # Build and write the deck object to an .apkg file
-    deck = build_deck(data)
-    write_deck(out, deck)
+    usage = (
+        "Usage: main OUTPUT [--ranks=FIRST-LAST] [--dump=PATH] [--refresh] "
+        "[--incremental]"
+    )
+    assert len(args) >= 2, usage
+    out, opts = args[1], args[2:]
+    # Which words of the frequency list to make cards for.
+    ranks = "1-1000"
+    # With a local Wiktionary dump, the words are read from that instead.
+    dump = None
+    for opt in opts:
+        if opt.startswith("--ranks="):
+            ranks = opt[len("--ranks="):]
+        elif opt.startswith("--dump="):
+            dump = Dump(opt[len("--dump="):], base=WIKTIONARY)
+        else:
+            assert opt in ("--refresh", "--incremental"), usage
+    first, last = (int(rank) for rank in ranks.split("-"))
+    # Pages are cached between runs. With --refresh, check every cached page
+    # with Wiktionary, only downloading those that have changed.
+    cache = HTTPCache(ttl=0 if "--refresh" in args else TTL)
+    # DeepL requests go over their own, smaller pool. Pages are parsed on a
+    # pool of processes, one per core.
+    with Fetcher(cache=cache) as fetcher, Fetcher(workers=4) as deepl, \
+            ProcessPoolExecutor() as parse_pool:
+        # Sentences translated in earlier runs are looked up rather than
+        # sent to DeepL again.
+        memory = TranslationMemory()
+        translator = DeepLTranslator(load_api_key(), deepl, memory=memory)
+        rank_index = RankIndex()
+        if dump is None:
+            # Get the words from the frequency list. The pipeline starts on
+            # the words as soon as the list page they're on is in.
+            words = iter_word_lists(first, last, WIKTIONARY, fetcher)
+            # Get the definitions and examples from Wiktionary. A word's
+            # page can change while its entry in the list doesn't, so this
+            # isn't checkpointed: the HTTP cache decides which pages to
+            # download again (stale ones, or all of them with --refresh),
+            # and the rest are only parsed again.
+            scrape = Stage(
+                "scrape",
+                partial(scrape_word_pages, fetcher=fetcher, pool=parse_pool),
+                batch_size=500,
+                checkpoint=False,
+            )
+        else:
+            words = iter_dump_word_lists(dump, list_pages(first, last), first, last)
+            # Big batches, since each batch of a compressed dump takes
+            # another pass through it. The words are read again from a
+            # different dump.
+            scrape = Stage(
+                "scrape",
+                partial(read_word_pages, dump=dump, pool=parse_pool),
+                version="dump-{}-{}-{}".format(*dump.key),
+                batch_size=5000,
+            )
+        # Reorder the example sentences in-place so that the one we want
+        # to make a card with comes first, borrowing one from the other
+        # words' examples where there isn't one.
+        index = SentenceIndex()
+        examples = Stage(
+            "examples",
+            partial(choose_example_sentences, ranks=rank_index, index=index),
+            batch_size=1000,
+        )
+        # Each stage (scraping and choosing examples included) checkpoints
+        # its output per word, so a rerun only redoes the words and stages
+        # that have changed.
+        stages = [
+            # Get translations from DeepL
+            Stage(
+                "translate",
+                partial(get_translations, translator=translator),
+                batch_size=200,
+            ),
+        ]
+        # Read the examples aloud, if there's a synthesizer installed. The
+        # synthesis runs on the parsing pool.
+        if TTS.available():
+            stages.append(Stage(
+                "tts",
+                partial(get_tts, tts=TTS(parse_pool)),
+                batch_size=200,
+            ))
+        else:
+            log.warning("No espeak-ng and ffmpeg, so no audio this time")
+        pipeline = Pipeline(stages)
+        # The examples are scored by the ranks of all the words, so note
+        # them as the list comes in, and borrowed from all the words'
+        # examples, so index them once they're scraped.
+        data = pipeline.run_stage(scrape, rank_index.observe(words))
+        log.info(f"Indexed {index.add_data(data)} new example sentences")
+        # The examples chosen depend on those, so choose them again when
+        # they change.
+        examples.version = f"3-{len(rank_index)}-{len(index)}"
+        data = pipeline.run_stage(examples, data.values())
+        # Drop the definitions that would make the same note as another.
+        # (Examples are only translated once when they're exactly the same;
+        # the translation memory sees to that.)
+        dedup_definitions(data)
+        data = pipeline.run(data)
+        pipeline.close()
+        index.close()
+        memory.close()
+    if dump is not None:
+        dump.close()
+    # Keep the finished data, to rebuild the deck from with main_store.
+    store = WordStore()
+    store.put_many(data)
+    store.close()
+    log.info(f'HTTP cache: {cache.stats}')
+    # Build and write the deck to an .apkg file. With --incremental, only
+    # the notes that changed since the last export are written.
+    write_deck(
+        out, build_notes(data), audio_for(data),
+        incremental="--incremental" in opts,
+    )
     log.info('Done.')
     return 0
 
-def main_pickle():
-    """Use data scraped already."""
-    # with open("worddata.pkl", 'rb') as f:
-    #     data = pickle.load(f)
-    # # Reorder the example sentences in-place so that the one we want to
-    # # make a card with comes first.
-    # choose_example_sentences(data)
-    # # Get translations from DeepL
-    # get_translations(data)
-    # # Save the data with translations.
-    # with open("worddata-tr.pkl", 'wb') as f:
-    #     pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
-    with open("worddata-tr.pkl", 'rb') as f:
-        data = pickle.load(f)
-    # Build and write the deck object to an .apkg file
-    deck = build_deck(data)
-    write_deck("./cz-1000.apkg", deck)
-
-def scrape_wiktionary(page: str) -> Data:
+def main_store(
+    out: str = "./cz-1000.apkg",
+    path: str = "worddata.sqlite",
+    incremental: bool = False,
+):
+    """Use data scraped already. Data pickled by earlier versions (in
+    worddata-tr.pkl) is moved into the store first."""
+    store = WordStore(path)
+    if len(store) == 0 and os.path.exists("worddata-tr.pkl"):
+        store.import_pickle("worddata-tr.pkl")
+    # Build and write the deck to an .apkg file
+    write_deck(
+        out, build_notes(store), audio_for(store), incremental=incremental
+    )
+    store.close()
+
+def scrape_wiktionary(
+    first: int = 1,
+    last: int = 1000,
+    base: str = WIKTIONARY,
+    fetcher: Optional[Fetcher] = None,
+) -> Data:
+    """Get the words ranked `first` to `last` in the frequency list, and fetch
+    and parse each word's page.
+
+    The pages of the list are fetched concurrently. Each word's page is
+    queued for fetching as soon as the list page it's on has been parsed,
+    rather than once the whole list is in, though that saves little: there
+    are far fewer list pages than word pages. The returned data is in rank
+    order.
+
+    Args:
+        first (int): The rank of the first word to get.
+        last (int): The rank of the last word to get.
+        base (str): The Wiktionary site to scrape.
+        fetcher (Fetcher): The fetcher to make requests with. One with the
+            default limits is used if not given.
+    """
+    if fetcher is None:
+        with Fetcher() as fetcher:
+            return scrape_wiktionary(first, last, base, fetcher)
+    words = {}
+    pages = []
+    for word in iter_word_lists(first, last, base, fetcher):
+        words[word.word] = word
+        pages.append(fetcher.submit(scrape_word_page, word.wk_link, fetcher))
+    # The pages finish in any order; collect them in rank order. Display a
+    # progress bar with tqdm.
+    for word, page in tqdm(zip(words.values(), pages), total=len(words)):
+        word.defs = page.result()
+    return words
+
+
+def list_pages(
+    first: int, last: int, page_size: int = LIST_PAGE_SIZE
+) -> List[Tuple[str, int]]:
+    """The names of the frequency list pages (like "1001-2000") that cover
+    the ranks `first` to `last`, with the rank of the first word on each."""
+    starts = range(
+        (first - 1) // page_size * page_size + 1, last + 1, page_size
+    )
+    return [(f"{start}-{start + page_size - 1}", start) for start in starts]
+
+
+def iter_word_lists(
+    first: int, last: int, base: str, fetcher: Fetcher
+) -> Iterator[WordData]:
+    """Yield the words ranked `first` to `last`, in rank order, without their
+    definitions. The list pages are all fetched at once, and the words on
+    each are yielded as soon as it's parsed (and every page before it). A
+    word that appears again on a later page keeps its first rank."""
+    def get_page(page: Tuple[str, int]) -> Data:
+        name, start = page
+        return scrape_word_list(name, base, fetcher, start)
+
+    seen = set()
+    for words in fetcher.imap(get_page, list_pages(first, last)):
+        for word in words.values():
+            if first <= word.rank <= last and word.word not in seen:
+                seen.add(word.word)
+                yield word
+
+
+def scrape_word_list(
+    page: str, base: str, fetcher: Fetcher, first_rank: int = 1
+) -> Data:
+    """Get the words on one page of the frequency list, without their
+    definitions. `first_rank` is the rank of the first word on the page."""
     # Build the string to get the right page of the list.
     url = (
-        "https://cs.wiktionary.org/wiki/P%C5%99%C3%ADloha:Frekven%C4%8Dn%"
+        f"{base}/wiki/P%C5%99%C3%ADloha:Frekven%C4%8Dn%"
         f"C3%AD_seznam_(%C4%8De%C5%A1tina)/%C4%8CNK_SYN2005/{page}"
     )
     # Get the word list.
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        raise RuntimeError(resp.status_code)
-    parser = WkWordListHTMLParser()
+    resp = fetcher.get(url)
+    parser = WkWordListHTMLParser(base, first_rank)
     parser.feed(resp.content.decode("utf-8"))
-    words = parser.data
-    # For each word, get all of the word data. Display a progress bar
-    # with tqdm.
-    for word in tqdm(words.values()):
-        resp = requests.get(word.wk_link)
-        if resp.status_code != 200:
-            raise RuntimeError(resp.status_code)
-        parser = WkWordPageHTMLParser()
-        parser.feed(resp.content.decode("utf-8"))
-        word.defs = parser.defs
-    return words
+    return parser.data
+
+
+def scrape_word_page(url: str, fetcher: Fetcher) -> List[Definition]:
+    """Fetch a word's page, parsing it as it streams in."""
+    return parse_word_page(fetcher.get(url, stream=True))
 
 
-def choose_example_sentences(data: Data):
+def scrape_word_pages(
+    words: Data, fetcher: Fetcher, pool: Optional[Executor] = None
+) -> None:
+    """Fetch and parse the Wiktionary page of each word, filling in its
+    definitions.
+
+    Without a pool, each page is parsed as it streams in, on the fetcher's
+    pool, and parsing stops at the end of the Czech section. This saves
+    parsing the rest of the page, but not (for all but huge pages) reading
+    it; see parse_word_page. (With a cache, only pages read to the end are
+    cached: those up to MAX_DRAIN_SIZE past the Czech section.) `main` always
+    passes a pool, so it doesn't take this path.
+
+    Parsing is CPU-bound, so once the pages are cached it's the slow part.
+    Given a pool of processes, whole pages are fetched and handed to the
+    pool to parse as they arrive.
+    """
+    urls = [word.wk_link for word in words.values()]
+    if pool is None:
+        defs = fetcher.imap(partial(scrape_word_page, fetcher=fetcher), urls)
+    else:
+        pages = (resp.content for resp in fetcher.map(urls))
+        defs = parse_pages(pages, pool)
+    # The results come back in rank order. Display a progress bar with tqdm.
+    for word, word_defs in tqdm(zip(words.values(), defs), total=len(words)):
+        word.defs = word_defs
+
+
+def choose_example_sentences(
+    data: Data,
+    ranks: Optional[RankIndex] = None,
+    index: Optional[SentenceIndex] = None,
+):
     """Reorder the example sentences for each definition such that the first one
     will be translated for use on the card. If all the example sentences are rejected,
     the first value will be None, and we will not fetch a translation or make a note
     for that definition.
+
+    The examples of up to 9 words are preferred, easiest first: the one whose
+    rarest word the learner won't know yet (see ranks.py) is the least rare,
+    then the shortest. All the words' examples are scored together.
+
+    Definitions left without an example borrow one that uses the word from
+    the examples of other words, if there's an `index` of them.
+
+    Args:
+        data (Data): The word data
+        ranks (RankIndex): The ranks of the words the learner will know. If
+            not given, just the ranks of the words in `data` are used.
+        index (SentenceIndex): All the example sentences scraped.
     """
+    if ranks is None:
+        ranks = RankIndex(data.values())
+    defs = [d for word in data.values() for d in word.defs]
+    sentences = [x for d in defs for x in d.examples]
+    counts = [len(d.examples) for d in defs]
+    # Each example's definition, and the rank of the word it's for.
+    def_ids = np.repeat(np.arange(len(defs)), counts)
+    known = np.repeat(
+        [word.rank for word in data.values() for _ in word.defs], counts
+    ).astype(np.int64)
+    scores, lengths = ranks.score(sentences, known)
+    too_long = lengths > 9
+    # Sort every definition's examples at once: by definition, then short
+    # enough first, then easiest, then shortest. The sort is stable, so
+    # ties keep their order.
+    order = np.lexsort((lengths, scores, too_long, def_ids))
+    start = 0
+    for (d, n) in zip(defs, counts):
+        chosen = order[start:start + n]
+        d.examples = [sentences[j] for j in chosen]
+        # If there are no example sentences, or the best is too long,
+        # insert None so that we don't fetch a translation.
+        if n == 0 or too_long[chosen[0]]:
+            d.examples.insert(0, None)
+        else:
+            # Get rid of non-breaking spaces and other odd whitespace
+            # where they occur. This is also the form the translation
+            # memory looks sentences up by.
+            d.examples[0] = normalize(d.examples[0])
+        start += n
+    if index is not None:
+        borrow_examples(data, ranks, index)
+
+
+def borrow_examples(data: Data, ranks: RankIndex, index: SentenceIndex):
+    """Fill in the missing examples from the short sentences in the index that
+    use the word, easiest first, giving each definition a different one. They
+    may not show the word in the right sense, but they show it in use."""
+    gaps = {}
     for word in data.values():
-        for d in word.defs:
-            # Sort in increasing order of sentence length.
-            d.examples.sort(key=lambda x: len(x.split()))
-            # If there are no example sentences, or the shortest is too long,
-            # insert None so that we don't fetch a translation.
-            if d.examples == [] or len(d.examples[0].split()) > 9:
-                d.examples.insert(0, None)
-            else:
-                # Get rid of non-breaking spaces where they occur.
-                d.examples[0] = d.examples[0].replace(u'\xa0', u' ')
-
-
-def _get_word_translation(text):
-    with open("deepl.apikey") as f:
-        api_key = f.readline()
-    url = 'https://api-free.deepl.com/v2/translate'
-    headers = {
-        'Authorization': f'DeepL-Auth-Key {api_key}'
-    }
-    data = {
-        'text': text,
-        "source_lang": 'CS',
-        'target_lang': 'EN',
-        'tag_handling': 'html',
-        'split_sentences': 0
-    }
-    response = requests.post(url, headers=headers, data=data)
-    if response.status_code != 200:
-        raise RuntimeError(response.status_code)
-    return response.json()["translations"][0]["text"]
-
-
-def get_translations(data: Data):
-    """Translate example and fill in example_en for each value in data
+        defs = [d for d in word.defs if d.examples[0] is None]
+        if defs:
+            gaps[word.word] = defs
+    if not gaps:
+        return
+    candidates = []
+    for (word, defs) in gaps.items():
+        # Don't borrow a sentence another definition already has.
+        taken = {plain(d.examples[0]) for d in data[word].defs
+                 if d.examples[0] is not None}
+        candidates.extend(
+            (word, sentence)
+            for sentence in index.find(word, limit=len(defs) + len(taken))
+            if sentence not in taken
+        )
+    scores, lengths = ranks.score(
+        [sentence for (_, sentence) in candidates],
+        np.array([data[word].rank for (word, _) in candidates], np.int64),
+    )
+    filled = 0
+    for i in np.lexsort((lengths, scores)):
+        (word, sentence) = candidates[i]
+        if gaps[word]:
+            d = gaps[word].pop(0)
+            d.examples[0] = highlight(sentence, word)
+            filled += 1
+    log.info(f"Borrowed examples for {filled} definitions")
+
+
+def get_translations(data: Data, translator: Optional[DeepLTranslator] = None):
+    """Translate example and fill in example_en for each value in data. The
+    examples are sent to DeepL in batches, rather than one request each.
 
     Args:
         data (Data): The word data
+        translator (DeepLTranslator): The translator to use. If not given,
+            one is made with the key in deepl.apikey.
     """
+    if translator is None:
+        with Fetcher(workers=4) as fetcher:
+            memory = TranslationMemory()
+            translator = DeepLTranslator(load_api_key(), fetcher, memory=memory)
+            get_translations(data, translator)
+            memory.close()
+            return
+    # Collect the definitions with a good example sentence to translate.
+    # Definitions with no good example sentences are skipped.
+    to_translate = [
+        definition
+        for entry in data.values()
+        for definition in entry.defs
+        if definition.examples[0] is not None
+    ]
+    translations = translator.translate([d.examples[0] for d in to_translate])
+    for definition, translation in zip(to_translate, translations):
+        definition.example_en = translation
     for entry in data.values():
         print(entry.word, ":")
         for definition in entry.defs:
             if definition.examples[0] is None:
-                # No good example sentences, skip this definition.
                 continue
             print('\t', definition.examples[0])
-            definition.example_en = _get_word_translation(definition.examples[0])
             print('\t', definition.example_en, '\n')
 
 
-def get_tts(data: Data):
-    pass
+def get_tts(data: Data, tts: Optional[TTS] = None):
+    """Read the chosen example of each definition aloud, and fill in its
+    audio file name. Sentences already in the audio cache aren't read again.
+
+    Args:
+        data (Data): The word data
+        tts (TTS): The synthesizer to use. If not given, one is made with its
+            own pool of processes.
+    """
+    if tts is None:
+        with ProcessPoolExecutor() as pool:
+            get_tts(data, TTS(pool))
+            return
+    to_read = [
+        definition
+        for entry in data.values()
+        for definition in entry.defs
+        if definition.examples[0] is not None
+    ]
+    names = tts.synthesize_all(d.examples[0] for d in to_read)
+    for definition in to_read:
+        definition.audio = names[definition.examples[0]]
+
+def audio_for(words: Data) -> List[str]:
+    """The audio files the notes for the words use."""
+    return audio_files(
+        definition.audio
+        for entry in words.values()
+        for definition in entry.defs
+    )
+
+# The scraped deck's IDs, randomly generated. Other decks built from the same
+# kind of notes (llm-cards.py's) pass their own.
+MODEL_ID = 3923034357
+DECK_ID = 8898791874
 
-def build_deck(data: Data) -> Deck:
+def make_model(model_id: int = MODEL_ID, name: str = 'Czech Definition') -> Model:
     # Define note type
-    model = Model(
-        3923034357,  # Unique model ID randomly generated
-        'Czech Definition',
+    return Model(
+        model_id,
+        name,
         fields=[
             {"name": "Definition"},
             {"name": "Word"},
@@ -370,27 +775,44 @@ def build_deck(data: Data) -> Deck:
         }
         """,   # custom styling
     )
-    # Create deck
-    deck = Deck(
-        8898791874,  # Unique deck ID randomly generated
-        'My Refold Czech'
-    )
-    # Add notes
-    for word in data.values():
+
+def build_notes(
+    words: Union[Data, Iterable[WordData]],
+    model: Optional[Model] = None,
+    guid_namespace: str = '',
+) -> Iterator[Note]:
+    """Make the notes for the deck, one word at a time, so that the words can
+    come from a generator, or a `WordStore` too big to load at once.
+
+    Notes for another deck than the scraped one need a `guid_namespace`, so
+    that their GUIDs don't clash with its notes' for the same words in Anki.
+    """
+    if isinstance(words, Mapping):
+        words = words.values()
+    if model is None:
+        model = make_model()
+    for word in words:
         # Make a note for every definition, not every word (since a word
         # can mean quite different things in different conditions). Create
         # notes even when we're missing an example, since they won't have cards
         # created when blank, but I can add examples later.
         for definition in word.defs:
-            deck.add_note(make_note(definition, word, model))
-    # Return
-    return deck
+            yield make_note(definition, word, model, guid_namespace)
 
 def make_note(
-    definition: Definition, word: WordData, model: Model
+    definition: Definition,
+    word: WordData,
+    model: Model,
+    guid_namespace: str = '',
 ) -> Note:
+    # Identify the note by what it's for, not its contents, so that fixing a
+    # note updates it in Anki rather than adding another.
+    guid_parts = (word.word, definition.definition)
+    if guid_namespace:
+        guid_parts = (guid_namespace,) + guid_parts
     my_note = Note(
         model=model,
+        guid=guid_for(*guid_parts),
         fields=[
             # Definition
             definition.definition,
@@ -403,7 +825,7 @@ def make_note(
             # EnglishExample
             definition.example_en if definition.example_en else '',
             # ExampleAudio
-            '',    # TODO
+            f'[sound:{definition.audio}]' if definition.audio else '',
             # Wiktionary
             word.wk_link,
             # Rank
@@ -412,12 +834,24 @@ def make_note(
     )
     return my_note
 
-def write_deck(out: str, deck: Deck) -> None:
-    package = Package(deck)
-    # In case we add TTS later: 
-    # files = None   # TODO: using data
-    # package.media_files = [f'../audio/{file}' for file in files]
-    package.write_to_file(out)
+def write_deck(
+    out: str,
+    notes: Iterable[Note],
+    media_files: Iterable[str] = (),
+    incremental: bool = False,
+    deck_id: int = DECK_ID,
+    deck_name: str = 'My Refold Czech',
+) -> None:
+    """Write the notes, and the media files they use, to an .apkg file as
+    the notes come. If `incremental`, only write those that are new or have
+    changed since the last incremental export."""
+    # Create deck
+    deck = Deck(deck_id, deck_name)
+    manifest = manifest_for(out) if incremental else None
+    with DeckWriter(out, deck, manifest=manifest) as writer:
+        for path in media_files:
+            writer.add_media(path)
+        writer.add_notes(notes)
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,191 @@
+"""An incremental, checkpointed pipeline for building the Czech deck.
+
+The deck is built by running each word through a list of stages (scrape its
+page, choose an example, translate it...). After each batch of words, every
+stage checkpoints its output for each word to SQLite (in the word store's JSON
+encoding), keyed by a hash of that word's input and the stage's code: the
+source of the stage function's module, and of every module of this project it
+imports, directly or not (see `project_sources`). On the next run, a stage
+skips the words whose input and code haven't changed, so:
+
+- a run that crashed (or hit a 429) resumes from the last completed batch;
+- after editing one stage, or anything it calls, only that stage and the
+  stages after it redo work, and only for the words whose data actually
+  changed.
+
+Editing a module that much of the build imports (like main.py) redoes every
+stage, since any of them might call the edited code. Changes outside the
+code, like a new DeepL glossary, need the stage's `version` bumping.
+
+A stage whose output can change without its input changing (scraping a page
+that may have been edited since) can opt out of checkpoints, and runs for
+every word every time.
+"""
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Union
+from dataclasses import dataclass
+from types import ModuleType
+import hashlib
+import inspect
+import os
+import sys
+import sqlite3
+import logging as log
+
+from words import Data, WordData
+from store import word_from_json, word_to_json
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS checkpoints (
+    stage TEXT NOT NULL,
+    word TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    output TEXT NOT NULL,
+    PRIMARY KEY (stage, word)
+);
+'''
+
+
+@dataclass
+class Stage:
+    """One step of the pipeline.
+
+    Args:
+        name (str): Names the stage's checkpoints.
+        fn (Callable): Fills in the data for the words it's given, in place,
+            like `choose_example_sentences` and `get_translations` do.
+        version (str): Bump to redo the stage when something it depends on,
+            other than the project's code, changes.
+        batch_size (int): How many words to give `fn` at once. Checkpoints are
+            saved after each batch.
+        checkpoint (bool): Whether to checkpoint the stage at all. If not,
+            it's run for every word, and it's up to `fn` to reuse what it can.
+    """
+    name: str
+    fn: Callable[[Data], None]
+    version: str = "1"
+    batch_size: int = 50
+    checkpoint: bool = True
+
+    def fingerprint(self) -> str:
+        """Identify this version of the stage's code."""
+        # Look through functools.partial for the actual function.
+        fn = getattr(self.fn, "func", self.fn)
+        digest = hashlib.sha256(f"{self.name}\n{self.version}\n".encode("utf-8"))
+        module = inspect.getmodule(fn)
+        if module is None:
+            digest.update(repr(fn).encode("utf-8"))
+        else:
+            for (path, source) in sorted(project_sources(module).items()):
+                digest.update(f"{os.path.basename(path)}\n".encode("utf-8"))
+                digest.update(source)
+        return digest.hexdigest()
+
+
+# The project's code is everything under the repository's root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def project_sources(module: ModuleType) -> Dict[str, bytes]:
+    """The source of `module` and of every module of the project that it
+    imports, directly or not, by file."""
+    sources: Dict[str, bytes] = {}
+    pending = [module]
+    seen = set()
+    while pending:
+        module = pending.pop()
+        if module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+        path = getattr(module, "__file__", None)
+        if path is None or not os.path.abspath(path).startswith(ROOT + os.sep):
+            continue
+        with open(path, "rb") as f:
+            sources[os.path.abspath(path)] = f.read()
+        # Follow the modules it imports, and those of the names it imports
+        # from them.
+        for value in vars(module).values():
+            if isinstance(value, ModuleType):
+                pending.append(value)
+            else:
+                imported = sys.modules.get(getattr(value, "__module__", None) or "")
+                if imported is not None:
+                    pending.append(imported)
+    return sources
+
+
+class Pipeline:
+    """Run words through `stages`, checkpointing to the database at `path`."""
+
+    def __init__(self, stages: List[Stage], path: str = "checkpoints.sqlite"):
+        self.stages = stages
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _input_hash(self, fingerprint: str, word: WordData) -> str:
+        digest = hashlib.sha256(fingerprint.encode("utf-8"))
+        digest.update(word_to_json(word).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _checkpoint(self, stage: Stage, word: str) -> Optional[tuple]:
+        return self.db.execute(
+            "SELECT input_hash, output FROM checkpoints "
+            "WHERE stage = ? AND word = ?", (stage.name, word)
+        ).fetchone()
+
+    def run_stage(self, stage: Stage, words: Iterable[WordData]) -> Data:
+        """Run one stage over the words, returning the data in the order the
+        words came in. Words are taken from `words` as they're needed, and
+        each batch is run as soon as it's full."""
+        fingerprint = stage.fingerprint()
+        data = {}
+        pending = []
+        done = 0
+
+        def run_batch():
+            stage.fn({word: data[word] for (word, _) in pending})
+            if not stage.checkpoint:
+                pending.clear()
+                return
+            # Save the checkpoints for the whole batch at once.
+            self.db.executemany(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                [
+                    (stage.name, word, input_hash, word_to_json(data[word]))
+                    for (word, input_hash) in pending
+                ]
+            )
+            self.db.commit()
+            pending.clear()
+
+        # Find which words need the stage doing. Take the rest from their
+        # checkpoints.
+        for word_data in words:
+            word = word_data.word
+            input_hash = None
+            if stage.checkpoint:
+                input_hash = self._input_hash(fingerprint, word_data)
+                row = self._checkpoint(stage, word)
+                if row is not None and row[0] == input_hash:
+                    data[word] = word_from_json(row[1])
+                    continue
+            data[word] = word_data
+            pending.append((word, input_hash))
+            done += 1
+            if len(pending) == stage.batch_size:
+                run_batch()
+        if pending:
+            run_batch()
+        log.info(f"Stage {stage.name}: did {done} of {len(data)} words")
+        return data
+
+    def run(self, words: Union[Data, Iterable[WordData]]) -> Data:
+        """Run every stage over the words, in order. The first stage starts
+        on the words as they come in from `words`."""
+        if isinstance(words, Mapping):
+            words = words.values()
+        for stage in self.stages:
+            words = self.run_stage(stage, words).values()
+        return dict((word.word, word) for word in words)
@@ -0,0 +1,140 @@
+"""Score example sentences by the words a learner won't know yet.
+
+The words are learned in frequency order, so someone learning the word
+ranked N knows, roughly, the words ranked before it. A sentence is only as
+easy as the rarest word in it that they don't know yet, so that's its score:
+the highest rank among its words ranked after N, or 0 if they know them all.
+Words that aren't in the frequency list at all count as rarer than any that
+are.
+
+The frequency list has each word in its dictionary form, but Czech words
+change their endings a lot ("kniha", "knihy", "knize", "knihou"...), so most
+of the words in a sentence aren't in the list as they're written. A form
+that isn't is looked up by its stem instead: the word with a common ending
+taken off, matched against the list's words with theirs taken off. That's
+only a rough stand-in for lemmatizing: it misses forms that change their
+stem ("jsem" for "být"), and now and then matches an unrelated word with the
+same stem. Forms still not found count as rarer than any listed word.
+
+`RankIndex` maps each word to its rank once, and scores a whole batch of
+sentences at a time: each sentence is tokenized and its tokens looked up in
+Python, once, then the ranks of all the batch's tokens go into one NumPy
+array, and each sentence's score is a single reduction over it.
+"""
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+from itertools import chain
+import re
+import numpy as np
+
+from words import WordData
+
+TOKEN = re.compile(r"\w+")
+TAG = re.compile(r"<[^>]+>")
+# Common endings of Czech nouns, adjectives and verbs, longest first.
+ENDINGS = sorted(
+    """ami ách ech ích ové ovi ům ám em ou ého ému ých ým ými ími ímu ího
+    at ít et ovat uje ují í é á ý y u a e i o ě ů""".split(),
+    key=len, reverse=True,
+)
+# Stems shorter than this are too ambiguous to match on.
+MIN_STEM = 3
+
+
+def tokenize(sentence: str) -> List[str]:
+    """The words of a sentence, lowercased, without its markup."""
+    return TOKEN.findall(TAG.sub(" ", sentence).lower())
+
+
+def stem(token: str) -> str:
+    """A word with its ending, if it has a common one, taken off."""
+    for ending in ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= MIN_STEM:
+            return token[:-len(ending)]
+    return token
+
+
+class RankIndex:
+    """The frequency rank of each word, for scoring sentences.
+
+    Args:
+        words (Iterable[WordData]): The words, with their ranks. More can be
+            added later.
+    """
+
+    def __init__(self, words: Iterable[WordData] = ()) -> None:
+        # Each word's id, and each id's rank. Id 0 is for words not in the
+        # list; its rank is worked out when scoring.
+        self.ids: Dict[str, int] = {}
+        self.ranks: List[int] = [0]
+        # The best ranked word with each stem, for the forms not in the list.
+        self.stems: Dict[str, int] = {}
+        self._array = None
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, word: WordData) -> None:
+        token = word.word.lower()
+        if token in self.ids:
+            # A word listed twice keeps its better rank.
+            i = self.ids[token]
+            self.ranks[i] = min(self.ranks[i], word.rank)
+        else:
+            self.ids[token] = len(self.ranks)
+            self.ranks.append(word.rank)
+        i = self.ids[token]
+        best = self.stems.get(stem(token))
+        if best is None or self.ranks[i] < self.ranks[best]:
+            self.stems[stem(token)] = i
+        self._array = None
+
+    def observe(self, words: Iterable[WordData]) -> Iterator[WordData]:
+        """Pass the words on, adding each to the index on the way."""
+        for word in words:
+            self.add(word)
+            yield word
+
+    def rank_array(self) -> np.ndarray:
+        """Each id's rank, with words not in the list ranked last."""
+        if self._array is None:
+            self._array = np.array(self.ranks, dtype=np.int64)
+            self._array[0] = self._array.max() + 1
+        return self._array
+
+    def token_ids(self, sentence: str) -> List[int]:
+        (ids, stems) = (self.ids, self.stems)
+        return [
+            ids.get(token) or stems.get(stem(token), 0)
+            for token in tokenize(sentence)
+        ]
+
+    def score(
+        self, sentences: Sequence[str], known: Sequence[int]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Score each sentence for a learner who knows the words ranked up to
+        the matching entry of `known`.
+
+        Returns:
+            The scores, and how many words (split on whitespace, as the length
+            limit on examples counts them) each sentence has.
+        """
+        token_ids = [self.token_ids(s) for s in sentences]
+        n_tokens = np.fromiter(map(len, token_ids), np.int64, len(sentences))
+        words = np.fromiter(
+            (len(s.split()) for s in sentences), np.int64, len(sentences)
+        )
+        scores = np.zeros(len(sentences), np.int64)
+        total = int(n_tokens.sum())
+        if total == 0:
+            return scores, words
+        ranks = self.rank_array()[
+            np.fromiter(chain.from_iterable(token_ids), np.int64, total)
+        ]
+        # Only the words ranked after what the learner knows count.
+        unknown = np.where(ranks > np.repeat(known, n_tokens), ranks, 0)
+        starts = np.cumsum(n_tokens) - n_tokens
+        has_tokens = n_tokens > 0
+        scores[has_tokens] = np.maximum.reduceat(unknown, starts[has_tokens])
+        return scores, words
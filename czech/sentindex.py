@@ -0,0 +1,156 @@
+"""An on-disk index of every example sentence scraped, by the words in them.
+
+Plenty of definitions have no example short enough to make a card with, but
+the word is often used in the examples on other words' pages. `SentenceIndex`
+keeps every example seen in SQLite, with an inverted index from each word in
+it to the sentences it's in, ordered by length, so finding the short
+sentences a word is used in is a single range scan of one index.
+
+Words are looked up by their lowercased, composed (NFC) form, so capitals and
+the way the accents are encoded don't matter, while the accents themselves
+do: "byt" and "být" are different words. Looking a word up with
+`ignore_accents` ignores the accents too, for when a sentence has lost them.
+
+The index keeps the sentences from every run, so it grows as more of the word
+list is scraped.
+"""
+from typing import Iterable, List
+import sqlite3
+import unicodedata
+
+from ranks import TAG, TOKEN
+from translate import normalize
+from words import Data
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sentences (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL     -- in words, as examples are limited by
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    sentence INTEGER NOT NULL REFERENCES sentences (id),
+    PRIMARY KEY (token, length, sentence)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    folded TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tokens_folded ON tokens (folded);
+'''
+
+
+def key(token: str) -> str:
+    """The form a word is indexed by."""
+    return unicodedata.normalize('NFC', token).lower()
+
+
+def fold(token: str) -> str:
+    """A word without its accents, e.g. "byt" for "být"."""
+    decomposed = unicodedata.normalize('NFD', token.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def plain(sentence: str) -> str:
+    """A sentence without its markup, in normalized form."""
+    return normalize(TAG.sub('', sentence))
+
+
+def highlight(sentence: str, word: str) -> str:
+    """Mark the uses of `word` in a plain sentence in bold, like Wiktionary
+    marks the word an example is for."""
+    word = key(word)
+    return TOKEN.sub(
+        lambda m: f'<b>{m[0]}</b>' if key(m[0]) == word else m[0], sentence
+    )
+
+
+class SentenceIndex:
+    """Example sentences, and the words used in each, stored in SQLite.
+
+    Args:
+        path (str): The database to keep the index in.
+    """
+
+    def __init__(self, path: str = 'sentences.sqlite') -> None:
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __len__(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM sentences').fetchone()[0]
+
+    def add(self, sentences: Iterable[str]) -> int:
+        """Index the sentences not already in the index, returning how many
+        there were."""
+        added = 0
+        postings = []
+        with self.db:
+            for sentence in sentences:
+                text = plain(sentence)
+                if not text:
+                    continue
+                length = len(text.split())
+                cur = self.db.execute(
+                    'INSERT OR IGNORE INTO sentences (text, length) VALUES (?, ?)',
+                    (text, length),
+                )
+                if cur.rowcount == 0:
+                    continue
+                added += 1
+                postings.extend(
+                    (token, length, cur.lastrowid)
+                    for token in {key(token) for token in TOKEN.findall(text)}
+                )
+            # Insert the postings in the index's order, so that each goes
+            # next to the last.
+            postings.sort()
+            self.db.executemany('INSERT INTO postings VALUES (?, ?, ?)', postings)
+            self.db.executemany(
+                'INSERT OR IGNORE INTO tokens VALUES (?, ?)',
+                ((token, fold(token)) for token in {p[0] for p in postings}),
+            )
+        return added
+
+    def add_data(self, data: Data) -> int:
+        """Index all the examples of the words' definitions."""
+        return self.add(
+            example
+            for word in data.values()
+            for d in word.defs
+            for example in d.examples
+            if example is not None
+        )
+
+    def find(
+        self,
+        word: str,
+        max_words: int = 9,
+        limit: int = 10,
+        ignore_accents: bool = False,
+    ) -> List[str]:
+        """The shortest sentences, of up to `max_words` words, that use
+        `word`, shortest first. With `ignore_accents`, they may use it with
+        different accents."""
+        if not ignore_accents:
+            rows = self.db.execute(
+                'SELECT text FROM postings JOIN sentences ON sentences.id = sentence '
+                'WHERE token = ? AND postings.length <= ? '
+                'ORDER BY postings.length, sentence LIMIT ?',
+                (key(word), max_words, limit),
+            )
+        else:
+            # Each spelling is its own range of the index, so merge them.
+            rows = self.db.execute(
+                'SELECT DISTINCT text, postings.length, sentence FROM tokens '
+                'JOIN postings ON postings.token = tokens.token '
+                'JOIN sentences ON sentences.id = sentence '
+                'WHERE folded = ? AND postings.length <= ? '
+                'ORDER BY postings.length, sentence LIMIT ?',
+                (fold(word), max_words, limit),
+            )
+        return [row[0] for row in rows]
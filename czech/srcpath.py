@@ -0,0 +1,12 @@
+"""Make the HTTP and deck helpers shared with the monarchs scraper, in
+../src, importable.
+
+Every module here that imports one of them imports this first, so that it
+works however it's imported, not just after `main`.
+"""
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SRC not in sys.path:
+    sys.path.append(SRC)
@@ -0,0 +1,234 @@
+"""A versioned on-disk store for the word data, in place of pickles.
+
+Words, their definitions and their examples are kept in separate SQLite
+tables, so that:
+
+- a word is only loaded when it's asked for;
+- words can be added, and single words or translations updated, in place;
+- questions like "which definitions still need a translation?" are one query.
+
+`WordStore` behaves like a `Data` dict (iterating in rank order), so it can be
+handed straight to `build_notes`. The schema version is kept in SQLite's
+user_version, and older stores are migrated when opened.
+
+The JSON encoding of a word used by the pipeline's checkpoints also lives
+here. Unlike a pickle, it still loads after a field with a default is added
+to the dataclasses.
+"""
+from typing import Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple
+from dataclasses import asdict, fields
+import json
+import pickle
+import sqlite3
+
+from words import Data, Definition, WordData
+
+# The current schema version.
+VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE words (
+    word TEXT PRIMARY KEY,
+    rank INTEGER NOT NULL,
+    wk_link TEXT NOT NULL
+);
+CREATE INDEX words_rank ON words (rank);
+CREATE TABLE definitions (
+    id INTEGER PRIMARY KEY,
+    word TEXT NOT NULL REFERENCES words (word) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    english TEXT NOT NULL,      -- JSON list of strings
+    example_en TEXT,
+    audio TEXT
+);
+CREATE INDEX definitions_word ON definitions (word, position);
+CREATE TABLE examples (
+    definition_id INTEGER NOT NULL
+        REFERENCES definitions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT,                  -- NULL where no example was good enough
+    PRIMARY KEY (definition_id, position)
+);
+'''
+
+# Functions that bring a store from version N to N + 1.
+MIGRATIONS: Dict[int, Callable[[sqlite3.Connection], None]] = {
+    0: lambda db: db.executescript(SCHEMA),
+}
+
+
+def word_to_json(word: WordData) -> str:
+    return json.dumps(asdict(word), ensure_ascii=False)
+
+
+def word_from_json(text: str) -> WordData:
+    return word_from_dict(json.loads(text))
+
+
+def word_from_dict(d: dict) -> WordData:
+    # Ignore any fields that no longer exist; missing ones take their
+    # defaults.
+    def known(cls, d):
+        names = {f.name for f in fields(cls)}
+        return {k: v for (k, v) in d.items() if k in names}
+
+    word = known(WordData, d)
+    word['defs'] = [Definition(**known(Definition, x)) for x in d['defs']]
+    return WordData(**word)
+
+
+class _Legacy:
+    # Stands in for the dataclasses when reading old pickles.
+    pass
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name in ('Definition', 'WordData'):
+            return _Legacy
+        return super().find_class(module, name)
+
+
+class WordStore(MutableMapping[str, WordData]):
+    """Word data stored in the SQLite database at `path`."""
+
+    def __init__(self, path: str = 'worddata.sqlite') -> None:
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version > VERSION:
+            raise RuntimeError(
+                f'{path} has schema version {version}; '
+                f'this code only knows up to {VERSION}'
+            )
+        with self.db:
+            for v in range(version, VERSION):
+                MIGRATIONS[v](self.db)
+            self.db.execute(f'PRAGMA user_version = {VERSION}')
+
+    def close(self) -> None:
+        self.db.close()
+
+    # Reading.
+
+    def _load_defs(self, word: str) -> List[Definition]:
+        defs = []
+        rows = self.db.execute(
+            'SELECT id, definition, english, example_en, audio '
+            'FROM definitions WHERE word = ? ORDER BY position', (word,)
+        ).fetchall()
+        for (def_id, definition, english, example_en, audio) in rows:
+            examples = [
+                text for (text,) in self.db.execute(
+                    'SELECT text FROM examples WHERE definition_id = ? '
+                    'ORDER BY position', (def_id,)
+                )
+            ]
+            defs.append(Definition(
+                definition=definition,
+                english=json.loads(english),
+                examples=examples,
+                example_en=example_en,
+                audio=audio,
+            ))
+        return defs
+
+    def __getitem__(self, word: str) -> WordData:
+        row = self.db.execute(
+            'SELECT rank, wk_link FROM words WHERE word = ?', (word,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(word)
+        return WordData(
+            word=word, rank=row[0], wk_link=row[1], defs=self._load_defs(word)
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        # Fetch the keys up front, so the store can be updated while
+        # iterating.
+        words = self.db.execute('SELECT word FROM words ORDER BY rank')
+        return iter([word for (word,) in words.fetchall()])
+
+    def __len__(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM words').fetchone()[0]
+
+    def __contains__(self, word) -> bool:
+        return self.db.execute(
+            'SELECT 1 FROM words WHERE word = ?', (word,)
+        ).fetchone() is not None
+
+    def missing_translations(self) -> Iterator[Tuple[str, int, str]]:
+        """The (word, definition position, example) of every definition with
+        an example that hasn't been translated yet."""
+        return iter(self.db.execute(
+            'SELECT d.word, d.position, e.text '
+            'FROM definitions d JOIN examples e ON e.definition_id = d.id '
+            'JOIN words w ON w.word = d.word '
+            'WHERE e.position = 0 AND e.text IS NOT NULL '
+            'AND d.example_en IS NULL ORDER BY w.rank, d.position'
+        ).fetchall())
+
+    # Writing.
+
+    def _put(self, word: WordData) -> None:
+        # Replacing the word deletes its old definitions and examples.
+        self.db.execute('DELETE FROM words WHERE word = ?', (word.word,))
+        self.db.execute(
+            'INSERT INTO words VALUES (?, ?, ?)',
+            (word.word, word.rank, word.wk_link)
+        )
+        for (position, d) in enumerate(word.defs):
+            def_id = self.db.execute(
+                'INSERT INTO definitions '
+                '(word, position, definition, english, example_en, audio) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (word.word, position, d.definition,
+                 json.dumps(d.english, ensure_ascii=False),
+                 d.example_en, d.audio)
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO examples VALUES (?, ?, ?)',
+                [(def_id, i, text) for (i, text) in enumerate(d.examples)]
+            )
+
+    def __setitem__(self, word: str, data: WordData) -> None:
+        assert word == data.word, f'Storing {data.word} under {word}'
+        with self.db:
+            self._put(data)
+
+    def __delitem__(self, word: str) -> None:
+        with self.db:
+            if self.db.execute(
+                'DELETE FROM words WHERE word = ?', (word,)
+            ).rowcount == 0:
+                raise KeyError(word)
+
+    def put_many(self, words: Data) -> None:
+        """Add or replace many words in one transaction."""
+        with self.db:
+            for word in words.values():
+                self._put(word)
+
+    def set_translation(
+        self, word: str, position: int, example_en: Optional[str]
+    ) -> None:
+        """Update the translation of one definition's example in place."""
+        with self.db:
+            self.db.execute(
+                'UPDATE definitions SET example_en = ? '
+                'WHERE word = ? AND position = ?', (example_en, word, position)
+            )
+
+    def import_pickle(self, path: str) -> None:
+        """Add the words in a pickled `Data` dict, as written by earlier
+        versions of the scripts."""
+        with open(path, 'rb') as f:
+            data = _LegacyUnpickler(f).load()
+        self.put_many({
+            word: word_from_dict({
+                **vars(legacy),
+                'defs': [vars(d) for d in legacy.defs],
+            })
+            for (word, legacy) in data.items()
+        })
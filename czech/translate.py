@@ -0,0 +1,174 @@
+"""Translate example sentences with DeepL, many sentences per request.
+
+The DeepL API takes up to 50 `text` values in one request, as long as the
+whole request stays under 128 KiB. `DeepLTranslator` packs sentences into as
+few requests as fit those limits and sends a few of them at once over the
+fetcher's shared session.
+
+Translations are remembered in a `TranslationMemory`, so a sentence that has
+been translated before (on another page of the word list, or in an earlier
+run) is never sent to DeepL again.
+"""
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote_plus
+import sqlite3
+import unicodedata
+import logging as log
+
+import srcpath  # makes ../src importable
+from fetch import Fetcher
+
+API_URL = 'https://api-free.deepl.com/v2/translate'
+# Limits on a single request to the API.
+MAX_TEXTS = 50
+MAX_BYTES = 128 * 1024
+# Leave room for the other parameters and the headers.
+RESERVED_BYTES = 1024
+# The request options, other than the texts to translate.
+OPTIONS = [
+    ('source_lang', 'CS'),
+    ('target_lang', 'EN'),
+    ('tag_handling', 'html'),
+    ('split_sentences', '0'),
+]
+
+
+def normalize(text: str) -> str:
+    """Put a sentence in a standard form: composed characters, and single
+    ordinary spaces in place of any runs of whitespace (including the
+    non-breaking spaces Wiktionary uses)."""
+    text = unicodedata.normalize('NFC', text).replace('\xa0', ' ')
+    return ' '.join(text.split())
+
+
+class TranslationMemory:
+    """Translations of sentences already seen, stored in SQLite and looked up
+    by their normalized source text."""
+
+    def __init__(self, path: str = 'translations.sqlite') -> None:
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS translations '
+            '(source TEXT PRIMARY KEY, target TEXT NOT NULL)'
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self.db.close()
+
+    def lookup(self, sources: List[str]) -> Dict[str, str]:
+        """Find the known translations of the (normalized) sources, counting
+        the hits and misses."""
+        found = {}
+        for source in set(sources):
+            row = self.db.execute(
+                'SELECT target FROM translations WHERE source = ?', (source,)
+            ).fetchone()
+            if row is not None:
+                found[source] = row[0]
+        self.hits += sum(1 for source in sources if source in found)
+        self.misses += sum(1 for source in sources if source not in found)
+        return found
+
+    def add(self, translations: Dict[str, str]) -> None:
+        self.db.executemany(
+            'INSERT OR REPLACE INTO translations VALUES (?, ?)',
+            translations.items()
+        )
+        self.db.commit()
+
+
+def load_api_key(path: str = 'deepl.apikey') -> str:
+    with open(path) as f:
+        return f.readline().strip()
+
+
+class DeepLTranslator:
+    """Translate Czech text to English in batches.
+
+    Args:
+        api_key (str): The DeepL authentication key.
+        fetcher (Fetcher): Makes the requests. Its worker count bounds how
+            many batches are in flight at once.
+        url (str): The translate endpoint.
+        max_texts (int): Most texts to send in one request.
+        max_bytes (int): Largest request body to send.
+        memory (TranslationMemory): Where to look up and remember
+            translations, if anywhere.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        fetcher: Fetcher,
+        url: str = API_URL,
+        max_texts: int = MAX_TEXTS,
+        max_bytes: int = MAX_BYTES,
+        memory: Optional[TranslationMemory] = None,
+    ) -> None:
+        self.api_key = api_key
+        self.fetcher = fetcher
+        self.url = url
+        self.max_texts = max_texts
+        self.max_bytes = max_bytes - RESERVED_BYTES
+        self.memory = memory
+
+    def batches(self, texts: List[str]) -> List[List[str]]:
+        """Pack the texts, in order, into batches that fit in one request
+        each."""
+        batches = []
+        batch, size = [], 0
+        for text in texts:
+            # Each text is sent form-encoded as "&text=...".
+            text_size = len('&text=') + len(quote_plus(text))
+            if batch and (
+                len(batch) == self.max_texts
+                or size + text_size > self.max_bytes
+            ):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(text)
+            size += text_size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _translate_batch(self, batch: List[str]) -> List[str]:
+        headers = {'Authorization': f'DeepL-Auth-Key {self.api_key}'}
+        data: List[Tuple[str, str]] = [('text', text) for text in batch]
+        resp = self.fetcher.post(self.url, headers=headers, data=data + OPTIONS)
+        translations = [t['text'] for t in resp.json()['translations']]
+        if len(translations) != len(batch):
+            raise RuntimeError(
+                f'Sent {len(batch)} texts, got {len(translations)} back'
+            )
+        return translations
+
+    def _translate_all(self, texts: List[str]) -> List[str]:
+        batches = self.batches(texts)
+        log.info(f'Translating {len(texts)} texts in {len(batches)} requests')
+        results = []
+        for translations in self.fetcher.imap(self._translate_batch, batches):
+            results.extend(translations)
+        return results
+
+    def translate(self, texts: List[str]) -> List[str]:
+        """Translate the texts, returning the translations in the same
+        order."""
+        if self.memory is None:
+            return self._translate_all(texts)
+        # Only send the sentences we haven't seen before, and each of those
+        # only once.
+        sources = [normalize(text) for text in texts]
+        known = self.memory.lookup(sources)
+        new = list(dict.fromkeys(s for s in sources if s not in known))
+        if new:
+            translated = dict(zip(new, self._translate_all(new)))
+            self.memory.add(translated)
+            known.update(translated)
+        log.info(
+            f'Translation memory: {self.memory.hits} hits, '
+            f'{self.memory.misses} misses'
+        )
+        return [known[source] for source in sources]
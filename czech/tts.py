@@ -0,0 +1,123 @@
+"""Read the example sentences aloud, with espeak-ng.
+
+Each sentence is synthesized to WAV by espeak-ng and compressed to a small
+mono MP3 by ffmpeg, on a pool of worker processes. The audio is kept in a
+content-addressed cache: a sentence's file is named after a hash of the voice
+and the words spoken, so a sentence that has been read before (in an earlier
+run, or for another word) is never synthesized again, and sentences that only
+differ in their markup share a file.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import Executor
+import hashlib
+import html
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import logging as log
+
+# Where the audio is kept, next to the monarchs' images.
+AUDIO_DIR = '../audio'
+VOICE = 'cs'
+# Mono MP3 at 32 kbit/s: plenty for speech, and it plays everywhere Anki does.
+BITRATE = '32k'
+EXTENSION = 'mp3'
+ENGINES = ('espeak-ng', 'ffmpeg')
+TAG = re.compile(r'<[^>]+>')
+
+
+def spoken_text(text: str) -> str:
+    """The words to read out for a sentence, without its markup."""
+    return ' '.join(html.unescape(TAG.sub('', text)).split())
+
+
+def audio_name(text: str, voice: str = VOICE) -> str:
+    """The cache's file name for `text` read in `voice`."""
+    key = f'{voice}\n{spoken_text(text)}'.encode('utf-8')
+    return f'tts-{hashlib.sha256(key).hexdigest()[:20]}.{EXTENSION}'
+
+
+def synthesize(job: Tuple[str, str, str]) -> str:
+    """Read `text` in `voice` into the audio file at `path`. Runs in a worker
+    process. The file only appears once it's complete."""
+    (text, voice, path) = job
+    directory = os.path.dirname(path)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        wav = os.path.join(tmp, 'speech.wav')
+        out = os.path.join(tmp, os.path.basename(path))
+        subprocess.run(
+            ['espeak-ng', '-v', voice, '-w', wav, '--stdin'],
+            input=spoken_text(text).encode('utf-8'),
+            check=True, capture_output=True,
+        )
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', wav,
+             '-ac', '1', '-codec:a', 'libmp3lame', '-b:a', BITRATE, out],
+            check=True, capture_output=True,
+        )
+        os.replace(out, path)
+    return path
+
+
+class TTS:
+    """Synthesize sentences into the audio cache in `directory`.
+
+    Args:
+        pool (Executor): Runs the synthesis. A process pool, ideally.
+        voice (str): The espeak-ng voice to read with.
+        directory (str): Where the audio files are kept.
+    """
+
+    def __init__(
+        self, pool: Executor, voice: str = VOICE, directory: str = AUDIO_DIR
+    ) -> None:
+        self.pool = pool
+        self.voice = voice
+        self.directory = directory
+
+    @staticmethod
+    def available() -> bool:
+        """Whether espeak-ng and ffmpeg are installed."""
+        return all(shutil.which(engine) for engine in ENGINES)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def synthesize_all(self, texts: Iterable[str]) -> Dict[str, str]:
+        """Make sure each text has its audio in the cache, returning the file
+        name for each."""
+        names = {text: audio_name(text, self.voice) for text in texts}
+        # Each sentence is read once, however many texts it appears in.
+        todo: Dict[str, str] = {}
+        for (text, name) in names.items():
+            if name not in todo and not os.path.exists(self.path(name)):
+                todo[name] = text
+        if todo:
+            os.makedirs(self.directory, exist_ok=True)
+            log.info(f'Synthesizing {len(todo)} of {len(names)} sentences')
+            jobs = [
+                (text, self.voice, self.path(name))
+                for (name, text) in todo.items()
+            ]
+            for _ in self.pool.map(synthesize, jobs, chunksize=4):
+                pass
+        return names
+
+
+def audio_files(
+    names: Iterable[Optional[str]], directory: str = AUDIO_DIR
+) -> List[str]:
+    """The paths of the audio files with these names, skipping any that are
+    missing (with a warning)."""
+    paths = []
+    for name in dict.fromkeys(names):
+        if not name:
+            continue
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            paths.append(path)
+        else:
+            log.warning(f'Audio {name} is missing from {directory}')
+    return paths
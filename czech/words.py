@@ -0,0 +1,27 @@
+"""The word data scraped from Wiktionary and filled in by the later stages.
+
+These live in their own module so that stored data can be loaded whichever
+script is running. They use slots, to keep the memory per record down when
+there are many thousands of them.
+"""
+from typing import List, Dict
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Definition:
+    definition: str
+    english: List[str]       # the English word translations
+    examples: List[str]      # The example sentences
+    example_en: str = None   # The example in English
+    audio: str = None        # The audio file name
+
+@dataclass(slots=True)
+class WordData:
+    word: str                   # the root word
+    rank: int                   # its frequency rank
+    wk_link: str                # url for its Wiktionary page
+    defs: List[Definition]      # list of definitions and usage examples
+
+# Mapping from word to word data
+Data = Dict[str, WordData]
@@ -0,0 +1,156 @@
+"""Benchmarks for formatting the gospel.
+
+Usage: bench.py NAME
+
+Run from marks-gospel/, where mark.txt is.
+"""
+from typing import List
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from corpus import CorpusFormatter, iter_books
+from deck import iter_notes, write_deck
+from func import format_book, split_punc
+
+
+def read_mark() -> str:
+    with open("mark.txt", "r") as f:
+        return f.read()
+
+
+def make_book(raw: str, copies: int) -> str:
+    """A book `copies` times as long as `raw`, with its chapters numbered on
+    from each other, like a longer book such as Luke or Acts."""
+    chapters = re.split(r"Chapter ", raw)[1:]
+    res = []
+    for i in range(copies):
+        for (j, chapter) in enumerate(chapters):
+            rest = chapter.split("\n", 1)[1]
+            res.append(f"Chapter {i * len(chapters) + j + 1}\n{rest}")
+    return "".join(res)
+
+
+def bench_book(copies: List[int] = [1, 4, 16]) -> None:
+    """Format whole books of growing length."""
+    raw = read_mark()
+    with open("res.txt", "r") as f:
+        assert format_book(raw) == f.read(), "Mark differs from res.txt"
+    for n in copies:
+        book = make_book(raw, n)
+        verses = len(re.findall(r"<sup>", format_book(book)))
+        start = time.perf_counter()
+        format_book(book)
+        elapsed = time.perf_counter() - start
+        print(f'{n:>3}x Mark: {len(book) / 1e6:.2f} MB, {verses} verses in '
+              f'{elapsed:.3f}s, {verses / elapsed:,.0f} verses/s')
+
+
+def bench_split(lengths: List[int] = [1_000, 10_000, 100_000]) -> None:
+    """Split single verses of growing length. The time per character should
+    stay about the same."""
+    raw = read_mark()
+    words = re.sub(r"\s+", " ", re.sub(r"\d+", "", raw)).split(" ")
+    for n in lengths:
+        # Made-up verses, with Mark's mix of words and punctuation.
+        verse = ""
+        while len(verse) < n:
+            verse += " ".join(words[:n // 4]) + " "
+        verse = verse[:n]
+        start = time.perf_counter()
+        chunks = split_punc(verse)
+        elapsed = time.perf_counter() - start
+        assert "".join(chunks) == verse
+        print(f'{n:>8} chars: {len(chunks)} chunks in {elapsed:.4f}s, '
+              f'{n / elapsed / 1e6:.2f} M chars/s')
+
+
+def bench_corpus(n_books: int = 66) -> None:
+    """Format a Bible-sized corpus (as many books as the Bible, each a copy of
+    Mark) from a directory and from a zip, one worker process per CPU."""
+    raw = read_mark()
+    with open("res.txt", "r") as f:
+        expected = f.read()
+    with tempfile.TemporaryDirectory() as tmp:
+        books = os.path.join(tmp, "books")
+        os.makedirs(books)
+        archive = os.path.join(tmp, "books.zip")
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+            for i in range(n_books):
+                name = f"{i + 1:02}-book.txt"
+                with open(os.path.join(books, name), "w") as f:
+                    f.write(raw)
+                z.write(os.path.join(books, name), name)
+        size = n_books * len(raw) / 1e6
+        for (run, source) in (("directory", books), ("zip", archive)):
+            out = os.path.join(tmp, run)
+            # Time it, then run it again to measure the memory it takes
+            # (tracing slows it down).
+            for traced in (False, True):
+                if traced:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                with ProcessPoolExecutor() as pool:
+                    formatter = CorpusFormatter(out, pool)
+                    formatter.format_all(iter_books(source))
+                if not traced:
+                    elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            for name in os.listdir(out):
+                with open(os.path.join(out, name), "r") as f:
+                    assert f.read() == expected, f"{name} differs from res.txt"
+            print(f'{run:>9}: {size:.1f} MB, {formatter.chapters} chapters in '
+                  f'{elapsed:.2f}s, peak {peak / 2**20:.1f} MiB')
+
+
+def bench_deck(copies: List[int] = [1, 16]) -> None:
+    """Build memorization decks of whole books, both kinds."""
+    raw = read_mark()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in copies:
+            path = os.path.join(tmp, "book.txt")
+            with open(path, "w") as f:
+                f.write(make_book(raw, n))
+            for first_letter in (False, True):
+                kind = "first letters" if first_letter else "progressive"
+                # Time it, then run it again to measure the memory it takes
+                # (tracing slows it down).
+                for traced in (False, True):
+                    if traced:
+                        tracemalloc.start()
+                    start = time.perf_counter()
+                    with open(path, "r") as f:
+                        write_deck(os.path.join(tmp, "book.apkg"),
+                                   iter_notes(f, "Mark", first_letter), "Mark")
+                    if not traced:
+                        elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f'{n:>3}x Mark, {kind:>13}: {elapsed:.2f}s, '
+                      f'peak {peak / 2**20:.1f} MiB')
+
+
+BENCHMARKS = {
+    'book': bench_book,
+    'split': bench_split,
+    'corpus': bench_corpus,
+    'deck': bench_deck,
+}
+
+
+def run(args: List[str]) -> int:
+    assert len(args) == 2 and args[1] in BENCHMARKS, (
+        f"Usage: bench.py {{{'|'.join(BENCHMARKS)}}}"
+    )
+    BENCHMARKS[args[1]]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv))
@@ -0,0 +1,158 @@
+"""Format a whole corpus of books, like the Bible, the way func.py formats Mark.
+
+Usage: corpus.py SOURCE OUTPUT [--workers N]
+
+SOURCE is a directory of books, one .txt file each laid out like mark.txt, or
+a .zip or .tar(.gz/.bz2/.xz) archive of them. Each book is formatted into a
+file of the same name in the directory OUTPUT.
+
+Books are read a block at a time and cut into chapters as they go, and the
+chapters are formatted on a pool of worker processes. Formatted chapters are
+written out in order as soon as they are ready, with only a few chapters in
+flight at once, so memory use doesn't grow with the size of the corpus. Each
+book's file only appears once it's complete.
+"""
+from typing import Deque, IO, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import codecs
+import io
+import os
+import sys
+import tarfile
+import time
+import zipfile
+import logging as log
+
+from func import format_numbered_chapter
+
+CHAPTER = "Chapter "
+BLOCK_SIZE = 64 * 1024
+
+
+def iter_chapters(f: IO[str], block_size: int = BLOCK_SIZE) -> Iterator[str]:
+    """The chapters of the book in `f`, each the text after a "Chapter ", like
+    format_book splits them. Anything before the first chapter is skipped."""
+    buffer = ""
+    first = True
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        parts = (buffer + block).split(CHAPTER)
+        # The last part may carry on into the next block.
+        buffer = parts.pop()
+        for part in parts:
+            if not first:
+                yield part
+            first = False
+    if not first:
+        yield buffer
+
+
+def iter_books(source: str) -> Iterator[Tuple[str, IO[str]]]:
+    """The name and text of each book in the directory or archive `source`,
+    opened one at a time, in name order."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith(".txt"):
+                with open(os.path.join(source, name), "r") as f:
+                    yield name, f
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as z:
+            for info in sorted(z.infolist(), key=lambda i: i.filename):
+                if not info.is_dir() and info.filename.endswith(".txt"):
+                    with z.open(info) as raw:
+                        yield (os.path.basename(info.filename),
+                               io.TextIOWrapper(raw, encoding="utf-8"))
+    elif tarfile.is_tarfile(source):
+        # Read in stream mode, so a compressed archive is only decompressed
+        # once, front to back.
+        with tarfile.open(source, "r|*") as t:
+            for member in t:
+                if member.isfile() and member.name.endswith(".txt"):
+                    # The member can't seek, so decode it with a plain reader.
+                    raw = t.extractfile(member)
+                    yield (os.path.basename(member.name),
+                           codecs.getreader("utf-8")(raw))
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+class CorpusFormatter:
+    """Format books into the directory `out`, on `pool`.
+
+    Args:
+        out (str): Where to write the formatted books.
+        pool (Executor): Formats the chapters. A process pool, ideally.
+        max_len (int): Verses with more words than this are split.
+        in_flight (int): How many chapters to have formatting at once.
+    """
+
+    def __init__(
+        self, out: str, pool: Executor, max_len: int = 12, in_flight: int = 16
+    ) -> None:
+        self.out = out
+        self.pool = pool
+        self.max_len = max_len
+        self.in_flight = in_flight
+        # Formatted chapters waiting to be written, in order, and each book's
+        # output file. A None future marks the end of a book.
+        self.pending: Deque[Tuple[IO[str], Optional[Future]]] = deque()
+        self.books = 0
+        self.chapters = 0
+
+    def format_all(self, books: Iterable[Tuple[str, IO[str]]]) -> None:
+        os.makedirs(self.out, exist_ok=True)
+        for (name, f) in books:
+            log.info(f"Formatting {name}")
+            path = os.path.join(self.out, name)
+            dest = open(path + ".part", "w")
+            for chapter in iter_chapters(f):
+                self.pending.append((dest, self.pool.submit(
+                    format_numbered_chapter, chapter, self.max_len
+                )))
+                # Write out what's ready, waiting for the oldest chapter if
+                # too many are in flight.
+                self._drain(self.in_flight)
+            self.pending.append((dest, None))
+            self.books += 1
+        self._drain(0)
+
+    def _drain(self, keep: int) -> None:
+        while self.pending and (
+            len(self.pending) > keep or self.pending[0][1] is None
+            or self.pending[0][1].done()
+        ):
+            (dest, future) = self.pending.popleft()
+            if future is None:
+                dest.close()
+                os.replace(dest.name, dest.name[:-len(".part")])
+            else:
+                dest.write(future.result())
+                self.chapters += 1
+
+
+def main(args: List[str]) -> int:
+    usage = "Usage: corpus.py SOURCE OUTPUT [--workers N]"
+    assert len(args) in (3, 5), usage
+    workers = None
+    if len(args) == 5:
+        assert args[3] == "--workers", usage
+        workers = int(args[4])
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        formatter = CorpusFormatter(
+            args[2], pool, in_flight=4 * (workers or os.cpu_count() or 1)
+        )
+        formatter.format_all(iter_books(args[1]))
+    log.info(
+        f"Formatted {formatter.chapters} chapters of {formatter.books} books "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    log.basicConfig(stream=sys.stdout, level=log.INFO)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,136 @@
+"""Make an Anki deck for memorizing a book of the Bible, a verse per note.
+
+Usage: deck.py BOOK OUTPUT [--first-letter]
+
+BOOK is laid out like mark.txt. Each verse is cut into the same shortish
+lines as format_book cuts it into, and tested progressively: the first card
+asks for the first line, the next shows it and asks for the second, and so
+on. With --first-letter, each verse gets a single card instead, showing the
+first letter of each word as a prompt.
+
+The book is read a chapter at a time and its notes streamed to the deck
+writer, so a book's text is never held in memory whole, formatted or not.
+"""
+from typing import IO, Iterator, List
+import hashlib
+import html
+import os
+import re
+import sys
+import time
+import logging as log
+from genanki import Deck, Model, Note, guid_for
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from deckwriter import DeckWriter
+from corpus import iter_chapters
+from func import numbered_verses
+
+# Verses longer than this many lines have the rest in the last one.
+MAX_LINES = 10
+WORD = re.compile(r"(\w)[\w'-]*")
+
+
+def make_progressive_model() -> Model:
+    lines = [f"Line{i}" for i in range(1, MAX_LINES + 1)]
+    templates = []
+    for (i, line) in enumerate(lines):
+        # Only make a card for the lines a verse has.
+        shown = "".join(f"{{{{{l}}}}}<br>" for l in lines[:i])
+        templates.append({
+            'name': f'Line {i + 1}',
+            'qfmt': f'{{{{#{line}}}}}{{{{Reference}}}}<br>{shown}[...]'
+                    f'{{{{/{line}}}}}',
+            'afmt': f'{{{{Reference}}}}<br>{shown}<b>{{{{{line}}}}}</b>',
+        })
+    return Model(
+        1607392319,  # Unique model ID randomly generated
+        'Verse (progressive)',
+        fields=[{"name": "Reference"}] + [{"name": line} for line in lines],
+        templates=templates,
+        css=CSS,
+    )
+
+
+def make_first_letter_model() -> Model:
+    return Model(
+        1724689051,  # Unique model ID randomly generated
+        'Verse (first letters)',
+        fields=[{"name": "Reference"}, {"name": "FirstLetters"}, {"name": "Verse"}],
+        templates=[
+            {
+                'name': 'First letters',
+                'qfmt': '{{Reference}}<br>{{FirstLetters}}',
+                'afmt': '{{Reference}}<hr id="answer">{{Verse}}',
+            },
+        ],
+        css=CSS,
+    )
+
+
+CSS = """
+.card {
+font-family: arial;
+font-size: 20px;
+text-align: center;
+color: black;
+background-color: white;
+}
+"""
+
+
+def first_letters(text: str) -> str:
+    """`text` with each word cut down to its first letter, keeping the
+    punctuation."""
+    return WORD.sub(r"\1", text)
+
+
+def iter_notes(
+    f: IO[str], book: str, first_letter: bool = False, max_len: int = 12
+) -> Iterator[Note]:
+    """A note for each verse of the book in `f`, called `book`."""
+    model = make_first_letter_model() if first_letter else make_progressive_model()
+    for chapter in iter_chapters(f):
+        chap_no = chapter.split("\n", 1)[0].strip()
+        for (verse_no, lines) in numbered_verses(chapter, max_len):
+            lines = [html.escape(line.strip(), quote=False) for line in lines]
+            reference = f"{book} {chap_no}:{verse_no}"
+            if first_letter:
+                fields = [reference, " ".join(first_letters(l) for l in lines),
+                          "<br>".join(lines)]
+            else:
+                lines = lines[:MAX_LINES - 1] + [" ".join(lines[MAX_LINES - 1:])]
+                fields = [reference] + lines + [""] * (MAX_LINES - len(lines))
+            yield Note(
+                model=model,
+                # The same verse keeps its note between builds.
+                guid=guid_for(book, chap_no, verse_no, model.model_id),
+                fields=fields,
+            )
+
+
+def write_deck(out: str, notes: Iterator[Note], book: str) -> None:
+    # Each book gets its own deck, with an ID made from its name.
+    name = f"Memorize::{book}"
+    deck = Deck(int(hashlib.sha256(name.encode()).hexdigest()[:8], 16), name)
+    with DeckWriter(out, deck) as writer:
+        writer.add_notes(notes)
+
+
+def main(args: List[str]) -> int:
+    usage = "Usage: deck.py BOOK OUTPUT [--first-letter]"
+    assert len(args) in (3, 4), usage
+    first_letter = args[3:] == ["--first-letter"]
+    assert len(args) == 3 or first_letter, usage
+    # Name the book after its file, e.g. mark.txt is "Mark".
+    book = os.path.splitext(os.path.basename(args[1]))[0].title()
+    start = time.perf_counter()
+    with open(args[1], "r") as f:
+        write_deck(args[2], iter_notes(f, book, first_letter), book)
+    log.info(f"Wrote {args[2]} in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    log.basicConfig(stream=sys.stdout, level=log.INFO)
+    sys.exit(main(sys.argv))
@@ -1,83 +1,128 @@
 # https://www.biblical.ie/page.php?fl=NRSV/Mark
 
+from bisect import bisect_left, bisect_right
+import os
 import re
 
-def get_mark():
-    with open("/home/jasutton/code/other/marks-gospel/mark.txt", "r") as f:
+MARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mark.txt")
+# Compiled once, for all the chapters.
+CHAPTER = re.compile(r"Chapter ")
+HEADING = re.compile(r"\n\n((\w| |,|')+)\n\n")
+NEWLINE = re.compile(r"\n")
+VERSE = re.compile(r" ?\d+ ")
+NUMBERED_VERSE = re.compile(r" ?(\d+) ")
+
+def get_mark(path = MARK):
+    with open(path, "r") as f:
         data = f.read()
     return data
 
 def format_book(raw, max_len = 12):
-    chapters = re.split(r"Chapter ", raw)
-    res = ""
-    for chapter in chapters[1:]:
-        chap_no = chapter.split("\n")[0]
-        res += format_chapter(chapter, chap_no, max_len)
-        res += "\n"
-    return res
+    chapters = CHAPTER.split(raw)
+    return "".join(format_numbered_chapter(chapter, max_len) for chapter in chapters[1:])
+
+# Format the text following a "Chapter " heading, numbered from the heading, and
+# ending with a blank line.
+def format_numbered_chapter(chapter, max_len = 12):
+    chap_no = chapter.split("\n", 1)[0]
+    return format_chapter(chapter, chap_no, max_len) + "\n"
 
 def format_chapter(raw_text, chapter, max_len_w = 10):
     # Remove headings
-    x1 = re.sub(r"\n\n((\w| |,|')+)\n\n", "", raw_text)
+    x1 = HEADING.sub("", raw_text)
     # Remove line breaks
-    x2 = re.sub(r"\n", "", x1)
+    x2 = NEWLINE.sub("", x1)
     # Split into verses.
-    x3 = [x for x in re.split(r" ?\d+ ", x2) if x != '']
+    x3 = [x for x in VERSE.split(x2) if x != '']
     # Build the verses with proper numbers and split into shortish lines
     res = []
     for (i, v) in enumerate(x3):
-        # Superscript verse number.
-        v_no = f"<sup>{chapter}:{i+1}</sup>"
-        # If the verse is too long, split on punctuation.
-        if len(v.split()) > max_len_w:
-            #Find the approx middle punctuation of the verse.
-            chunks = split_punc(v)
-            # Split there and append, starting with the verse number.
-            res.append(v_no)
-            for chunk in chunks:
-                res.append(chunk)
-                if chunk:
-                    res.append("\n")
-        else:
-            # Otherwise, use the whole verse without splitting.
-            res.append(v_no)
-            res.append(v)
-            res.append("\n")
+        # Superscript verse number, then the verse in shortish lines.
+        res.append(f"<sup>{chapter}:{i+1}</sup>")
+        for chunk in verse_chunks(v, max_len_w):
+            res.append(chunk)
+            if chunk:
+                res.append("\n")
     return "".join(res)
 
+# The shortish lines to show a verse in.
+def verse_chunks(v, max_len_w = 10):
+    # If the verse is too long, split on punctuation.
+    if len(v.split()) > max_len_w:
+        return split_punc(v)
+    # Otherwise, use the whole verse without splitting.
+    return [v]
+
+# The verses of a chapter (the text following "Chapter "), numbered by the
+# numbers in the text rather than counted, so that a heading that isn't
+# removed, or a verse missing from the translation, doesn't put the numbers
+# out. Yields the verse number and its lines.
+def numbered_verses(raw_text, max_len_w = 10):
+    # Drop the chapter number, and any text before the first verse.
+    body = raw_text.split("\n", 1)[1] if "\n" in raw_text else ""
+    parts = NUMBERED_VERSE.split(NEWLINE.sub("", HEADING.sub("", body)))
+    for (number, v) in zip(parts[1::2], parts[2::2]):
+        if v != '':
+            yield int(number), [chunk for chunk in verse_chunks(v, max_len_w) if chunk]
+
+
+# Punctuation to prefer splitting verses after, including any closing quotes.
+PUNC = re.compile(r"\.'\"|,'\"|,'|\.\"|\?\"|!\"|,|;|:|\.|\?|!")
+SPACE = re.compile(r" ")
+
 
 # Cut the verse into sections that do not exceed the max length. Prioritise splitting
 # on punctuation, but use spaces if necessary.
-def split_punc(x, punc = r"\.'\"|,'\"|,'|\.\"|\?\"|!\"|,|;|:|\.|\?|!", target_len_c = 40, tol = 15):
+def split_punc(x, punc = PUNC, target_len_c = 40, tol = 15):
     # How many splits do we need to make based on the max length?
     splits = len(x) // target_len_c
     # Make the chunks roughly equal sizes.
     target = len(x) // splits
     res = []
-    # Look for punctuation and spaces.
-    ps = [p.end() for p in re.finditer(punc, x)]
-    sps = [sp.end() for sp in re.finditer(r" ", x)]
-    cands = ps + sps
+    # Look for punctuation and spaces, once, as offsets into the whole verse.
+    # Both lists are sorted, so the candidates near each cut are found by bisection.
+    ps = [p.end() for p in re.compile(punc).finditer(x)]
+    sps = [sp.end() for sp in SPACE.finditer(x)]
+    pos = 0
     for i in range(splits):
         # Find the first candidate that falls within the tolerance of the desired
         # splitting point. Prioritise punctuation by checking them first.
-        cut = None
-        for cand in cands:
-            # If there is no cut within the tolerance, take the first cut
-            # after the target.
-            if abs(cand - target) < tol:
-                cut = cand
-                break
+        want = pos + target
+        cut = first_within(ps, pos, want, tol)
+        if cut is None:
+            cut = first_within(sps, pos, want, tol)
         # If we didn't find a cut within the tolerance, find the value that minimises
-        # the distance to the target.
-        if cut == None:
-            cut = min(cands, key = lambda cand: abs(cand - target))
+        # the distance to the target, preferring punctuation on a tie.
+        if cut is None:
+            near = [c for c in (nearest(ps, pos, want), nearest(sps, pos, want))
+                    if c is not None]
+            cut = min(near, key = lambda cand: abs(cand - want))
         # Cut and add it to the result.
-        res.append(x[0:cut])
-        # Trim the string and adjust the candidates.
-        x = x[cut:]
-        cands = [cand - cut for cand in cands if cand - cut >= 0]
+        res.append(x[pos:cut])
+        pos = cut
     # Add the rest.
-    res.append(x)
+    res.append(x[pos:])
     # return.
-    return res
\ No newline at end of file
+    return res
+
+
+# The first of the sorted offsets `cands`, from `pos` on, that is within `tol`
+# of `want`, or None.
+def first_within(cands, pos, want, tol):
+    i = max(bisect_left(cands, pos), bisect_right(cands, want - tol))
+    if i < len(cands) and cands[i] < want + tol:
+        return cands[i]
+    return None
+
+
+# The offset in `cands`, from `pos` on, closest to `want` (the earlier on a tie),
+# or None if there are none.
+def nearest(cands, pos, want):
+    lo = bisect_left(cands, pos)
+    i = max(lo, bisect_left(cands, want))
+    best = None
+    for j in (i - 1, i):
+        if lo <= j < len(cands) and (
+                best is None or abs(cands[j] - want) < abs(best - want)):
+            best = cands[j]
+    return best
@@ -0,0 +1,98 @@
+"""Check the gospel formatter's output and speed against saved baselines.
+
+Usage: regress.py [--record]
+
+Formats mark.txt and bigger made-up books (Mark, over and over), and checks
+the output byte for byte against res.txt, repeated as many times. It then
+times each input (verses per second, best of a few runs), measures its peak
+memory, and compares them with perf-baseline.json. Exits with 1 if any
+output differs, or if any input got slower or bigger than the tolerances
+allow.
+
+--record saves the measurements as the new baseline. The baseline is only
+meaningful on the machine it was recorded on, so record one afresh on a new
+machine before relying on the checks.
+"""
+from typing import Dict, List
+import json
+import sys
+import time
+import tracemalloc
+
+from bench import read_mark
+from func import format_book
+
+BASELINE = "perf-baseline.json"
+# How many copies of Mark each input is.
+INPUTS = {"mark": 1, "mark-x4": 4, "mark-x16": 16}
+# Fail if throughput falls below this fraction of the baseline...
+MIN_SPEED = 0.7
+# ...or peak memory grows beyond this multiple of it.
+MAX_MEMORY = 1.5
+RUNS = 5
+
+
+def measure(book: str) -> Dict[str, float]:
+    """Verses formatted per second (the best of a few runs), and peak memory
+    in bytes."""
+    verses = format_book(book).count("<sup>")
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        format_book(book)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    format_book(book)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"verses_per_s": verses / best, "peak_bytes": peak}
+
+
+def main(args: List[str]) -> int:
+    usage = "Usage: regress.py [--record]"
+    assert args[1:] in ([], ["--record"]), usage
+    record = args[1:] == ["--record"]
+    raw = read_mark()
+    with open("res.txt", "r") as f:
+        golden = f.read()
+
+    failures = []
+    results = {}
+    for (name, copies) in INPUTS.items():
+        # Mark over and over, chapter numbers and all, so the expected output
+        # is just res.txt over and over.
+        book = raw * copies
+        if format_book(book) != golden * copies:
+            failures.append(f"{name}: output differs from res.txt")
+            continue
+        results[name] = measure(book)
+
+    if record and not failures:
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Recorded a new baseline in {BASELINE}")
+    elif not record:
+        with open(BASELINE, "r") as f:
+            baseline = json.load(f)
+        for (name, result) in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            speed = result["verses_per_s"] / base["verses_per_s"]
+            memory = result["peak_bytes"] / base["peak_bytes"]
+            if speed < MIN_SPEED:
+                failures.append(f"{name}: {speed:.0%} of the baseline speed")
+            if memory > MAX_MEMORY:
+                failures.append(f"{name}: {memory:.0%} of the baseline memory")
+
+    for (name, result) in results.items():
+        print(f'{name:>9}: {result["verses_per_s"]:,.0f} verses/s, '
+              f'peak {result["peak_bytes"] / 2**20:.2f} MiB')
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,252 @@
+"""Write Anki decks as their notes come, instead of all at once.
+
+genanki's `Package.write_to_file` wants every `Note` of the deck in memory,
+and inserts them into the collection one statement at a time. `DeckWriter`
+takes notes from any iterable (a generator, say) and inserts them into the
+collection SQLite in bulk, one transaction per batch, so memory use stays the
+same however big the deck gets.
+
+Media files are added to the .apkg as they come too, and identical files are
+only stored once: `add_media` returns the name a note should refer to the
+file by, which is the name it was first added under.
+
+Given a manifest, the writer exports incrementally. The manifest records a
+hash of every note (by GUID) and every media file (by name) in the last
+export; only notes and media that are new or have changed since then are
+written, and the manifest is updated. Notes need stable GUIDs for this, and
+Anki updates the notes it already has with the same GUIDs on import, so each
+incremental export is meant to be imported in turn.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+import logging as log
+from genanki import Deck, Model, Note
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+from genanki.note import _fix_deprecated_builtin_models_and_warn
+
+from media import file_digest
+
+
+def manifest_for(out: str) -> str:
+    """Where to keep the manifest for incremental exports to `out`."""
+    return os.path.splitext(out)[0] + '-manifest.json'
+
+
+def note_digest(note: Note) -> str:
+    """A hash of everything about a note that ends up in the deck."""
+    return hashlib.sha256('\x1f'.join([
+        str(note.model.model_id), note._format_tags(), note._format_fields()
+    ]).encode('utf-8')).hexdigest()
+
+
+class DeckWriter:
+    """Write `deck`, and the notes and media added to it, to the .apkg file
+    at `out`. The file only appears (replacing any old one) once the writer is
+    closed without an error.
+
+    Args:
+        out (str): Where to write the .apkg.
+        deck (Deck): The deck's id, name and description. Any notes already
+            in it are written first.
+        batch_size (int): How many notes to insert per transaction.
+        timestamp (float): Modification time for the notes and cards, as
+            seconds since the epoch. Now, by default.
+        manifest (str): Path of the manifest to export incrementally against,
+            if any. It needn't exist yet; the first export is then in full.
+    """
+
+    def __init__(
+        self,
+        out: str,
+        deck: Deck,
+        batch_size: int = 5000,
+        timestamp: Optional[float] = None,
+        manifest: Optional[str] = None,
+    ) -> None:
+        self.out = out
+        self.deck = deck
+        self.batch_size = batch_size
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # Note and card ids, counting up from the timestamp like genanki's.
+        self.ids = itertools.count(int(self.timestamp * 1000))
+        self.models: Dict[int, Model] = {}
+        self.notes: List[Tuple] = []
+        self.cards: List[Tuple] = []
+        self.n_notes = 0
+        # Media: the name stored under each digest, and the name of each zip
+        # member (as Anki's "media" file lists them).
+        self.media_names: Dict[str, str] = {}
+        self.media: Dict[str, str] = {}
+        self.media_taken: Set[str] = set()
+        # Incremental exports: the hashes from the last export, and those
+        # of everything in this one (whether written or not).
+        self.manifest = manifest
+        self.previous = {'notes': {}, 'media': {}}
+        if manifest is not None and os.path.exists(manifest):
+            with open(manifest) as f:
+                self.previous = json.load(f)
+        self.current = {'notes': {}, 'media': {}}
+        self.unchanged = 0
+
+        fd, self.db_path = tempfile.mkstemp(suffix='.anki2')
+        os.close(fd)
+        self.db = sqlite3.connect(self.db_path)
+        # The collection is rebuilt from scratch if anything goes wrong, so
+        # there's no need to journal or sync it.
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.executescript(APKG_SCHEMA)
+        self.db.executescript(APKG_COL)
+
+        directory = os.path.dirname(os.path.abspath(out))
+        fd, self.zip_path = tempfile.mkstemp(suffix='.part', dir=directory)
+        os.close(fd)
+        self.zip = zipfile.ZipFile(self.zip_path, 'w')
+
+        for note in deck.notes:
+            self.add_note(note)
+
+    def __enter__(self) -> 'DeckWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_note(self, note: Note) -> None:
+        """Add a note to the deck. Notes are written in batches."""
+        # Check the note like genanki's Note.write_to_db does.
+        note.fields = _fix_deprecated_builtin_models_and_warn(
+            note.model, note.fields
+        )
+        note._check_number_model_fields_matches_num_fields()
+        note._check_invalid_html_tags_in_fields()
+        if self.manifest is not None:
+            guid = note.guid
+            if guid in self.current['notes']:
+                log.warning(f'Skipping a second note with GUID {guid}: {note}')
+                return
+            digest = note_digest(note)
+            self.current['notes'][guid] = digest
+            if self.previous['notes'].get(guid) == digest:
+                self.unchanged += 1
+                return
+        self.models.setdefault(note.model.model_id, note.model)
+        mod = int(self.timestamp)
+        note_id = next(self.ids)
+        self.notes.append((
+            note_id, note.guid, note.model.model_id, mod, -1,
+            note._format_tags(), note._format_fields(), note.sort_field,
+            0, 0, '',
+        ))
+        for card in note.cards:
+            self.cards.append((
+                next(self.ids), note_id, self.deck.deck_id, card.ord, mod, -1,
+                0, -1 if card.suspend else 0, note.due,
+                0, 0, 0, 0, 0, 0, 0, 0, '',
+            ))
+        self.n_notes += 1
+        if len(self.notes) >= self.batch_size:
+            self.flush()
+
+    def add_notes(self, notes: Iterable[Note]) -> None:
+        for note in notes:
+            self.add_note(note)
+
+    def flush(self) -> None:
+        """Insert the notes added since the last flush."""
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)', self.notes
+            )
+            self.db.executemany(
+                'INSERT INTO cards VALUES '
+                '(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', self.cards
+            )
+        self.notes.clear()
+        self.cards.clear()
+
+    def add_media(self, path: str, name: Optional[str] = None) -> str:
+        """Add the file at `path` to the deck's media, as `name` (its own name
+        by default). Returns the name notes should use for it, which is the
+        name it was first added under if an identical file was added before.
+        """
+        name = name or os.path.basename(path)
+        digest = file_digest(path)
+        if digest in self.media_names:
+            return self.media_names[digest]
+        if name in self.media_taken:
+            raise ValueError(f'Different media files are both called {name}')
+        self.media_taken.add(name)
+        self.media_names[digest] = name
+        self.current['media'][name] = digest
+        if self.previous['media'].get(name) == digest:
+            # Anki has it already, from the last export.
+            return name
+        member = str(len(self.media))
+        self.zip.write(path, member)
+        self.media[member] = name
+        return name
+
+    def close(self) -> None:
+        """Finish writing the deck, and move it into place."""
+        self.flush()
+        # Add the deck and note types to the collection, as genanki's
+        # Deck.write_to_db does.
+        (decks,) = self.db.execute('SELECT decks FROM col').fetchone()
+        decks = json.loads(decks)
+        decks[str(self.deck.deck_id)] = self.deck.to_json()
+        (models,) = self.db.execute('SELECT models FROM col').fetchone()
+        models = json.loads(models)
+        for model in self.models.values():
+            models[str(model.model_id)] = model.to_json(
+                self.timestamp, self.deck.deck_id
+            )
+        with self.db:
+            self.db.execute(
+                'UPDATE col SET decks = ?, models = ?',
+                (json.dumps(decks), json.dumps(models))
+            )
+        self.db.close()
+        self.zip.write(
+            self.db_path, 'collection.anki2', compress_type=zipfile.ZIP_DEFLATED
+        )
+        self.zip.writestr('media', json.dumps(self.media))
+        self.zip.close()
+        os.remove(self.db_path)
+        os.replace(self.zip_path, self.out)
+        if self.manifest is not None:
+            self._save_manifest()
+
+    def _save_manifest(self) -> None:
+        previous, current = self.previous['notes'], self.current['notes']
+        added = sum(1 for guid in current if guid not in previous)
+        removed = sum(1 for guid in previous if guid not in current)
+        log.info(
+            f'Exported {added} new and '
+            f'{len(current) - added - self.unchanged} changed notes; '
+            f'{self.unchanged} unchanged, {removed} no longer in the deck'
+        )
+        # Write the new manifest atomically, so a crash never leaves it out
+        # of step with the export.
+        tmp = self.manifest + '.part'
+        with open(tmp, 'w') as f:
+            json.dump(self.current, f)
+        os.replace(tmp, self.manifest)
+
+    def abort(self) -> None:
+        """Give up on the deck, leaving any old file at `out` as it was."""
+        self.db.close()
+        self.zip.close()
+        os.remove(self.db_path)
+        os.remove(self.zip_path)
@@ -0,0 +1,207 @@
+"""Shared HTTP fetching for the scrapers.
+
+A `Fetcher` wraps one pooled `requests.Session` (so connections to a host are
+kept alive and reused) and a bounded pool of worker threads. Requests are
+spaced out by the process-wide adaptive rate limiter in `ratelimit.py`, which
+slows down for each host when it answers 429 or 503. Throttled requests are
+retried once the host allows, and other transient failures are retried with
+exponential backoff. Given an `HTTPCache`, GET responses are served from and
+stored in it.
+"""
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+from concurrent.futures import Future, ThreadPoolExecutor
+import time
+import logging as log
+import requests
+from requests.adapters import HTTPAdapter
+from httpcache import HTTPCache, RecordingStream
+from ratelimit import (
+    LIMITER, THROTTLE_STATUSES, AdaptiveLimiter, host_of, parse_retry_after
+)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Wikimedia requires descriptive headers
+USER_AGENT = 'moneng-anki/0.0.0 (https://github.com/kokestu/moneng-anki)'
+# Responses worth trying again: rate limiting and transient server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest to wait after a throttled response that doesn't say how long to.
+MAX_BACKOFF = 60.0
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """Build a session that keeps up to `pool_size` connections per host
+    alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['user-agent'] = USER_AGENT
+    return session
+
+
+class Fetcher:
+    """Fetch URLs over a shared session with a bounded pool of workers.
+
+    Args:
+        workers (int): How many requests may be in flight at once.
+        rate (float): The most requests to start per second, for hosts the
+            limiter hasn't seen yet, or None for no limit. The limiter slows
+            down below this when a host throttles us, but never goes above it.
+        start_rate (float): Requests per second to begin with, if less than
+            `rate`; the limiter then speeds up towards `rate`.
+        retries (int): How many times to retry a failed request.
+        throttle_retries (int): How many times to retry a throttled (429 or
+            503) request. These don't count towards `retries`, so that a long
+            scrape rides out a spell of throttling rather than aborting.
+        backoff (float): Seconds to wait before the first retry; doubles on
+            each subsequent retry.
+        timeout (float): Per-request timeout in seconds.
+        cache (HTTPCache): Where to cache GET responses, if anywhere.
+        limiter (AdaptiveLimiter): Paces requests to each host. The one shared
+            by the whole process by default.
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        rate: Optional[float] = 10.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30.0,
+        session: Optional[requests.Session] = None,
+        cache: Optional[HTTPCache] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        throttle_retries: int = 30,
+        start_rate: Optional[float] = None,
+    ) -> None:
+        self.workers = workers
+        self.rate = rate
+        self.start_rate = start_rate or rate
+        self.retries = retries
+        self.throttle_retries = throttle_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = limiter or LIMITER
+        self.session = session or make_session(pool_size=workers)
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self) -> 'Fetcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        # Make a request, retrying on connection errors and retryable
+        # statuses. Returns the last response whatever its status.
+        kwargs.setdefault('timeout', self.timeout)
+        host = host_of(url)
+        attempt = throttled = 0
+        while True:
+            self.limiter.wait(host, self.start_rate, max_rate=self.rate)
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                log.warning(f'{method} {url} failed ({e}), retrying...')
+            else:
+                status = resp.status_code
+                if (status in THROTTLE_STATUSES
+                        and throttled < self.throttle_retries):
+                    # Wait as long as the host asks, or back off if it
+                    # doesn't say. The limiter holds back every request to
+                    # the host meanwhile, not just this one.
+                    wait = parse_retry_after(resp.headers.get('retry-after'))
+                    if wait is None:
+                        wait = min(MAX_BACKOFF, self.backoff * 2 ** throttled)
+                    self.limiter.throttled(host, wait)
+                    throttled += 1
+                    log.info(f'{method} {url} returned {status}, retrying...')
+                    resp.close()
+                    continue
+                if status not in THROTTLE_STATUSES:
+                    self.limiter.succeeded(host)
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    return resp
+                log.warning(f'{method} {url} returned {status}, retrying...')
+                resp.close()
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _cached_get(self, url: str, **kwargs) -> requests.Response:
+        key = self.cache.key('GET', url, kwargs.get('params'))
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.record('hit')
+            return entry.to_response()
+        # Ask the server to only send the page if it has changed.
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if 'etag' in entry.headers:
+                headers['if-none-match'] = entry.headers['etag']
+            if 'last-modified' in entry.headers:
+                headers['if-modified-since'] = entry.headers['last-modified']
+        resp = self._send('GET', url, headers=headers, **kwargs)
+        if resp.status_code == 304 and entry is not None:
+            self.cache.record('revalidated')
+            self.cache.revalidated(key, entry, resp)
+            return entry.to_response()
+        if resp.status_code != 200:
+            raise RuntimeError(resp.status_code)
+        self.cache.record('miss')
+        if kwargs.get('stream'):
+            # Let the caller read the body as it comes, and store it once
+            # they've read it all.
+            resp.raw = RecordingStream(
+                resp.raw, lambda body: self.cache.put(key, resp, body)
+            )
+        else:
+            self.cache.put(key, resp)
+        return resp
+
+    def request(
+        self, method: str, url: str, cached: bool = True, **kwargs
+    ) -> requests.Response:
+        """Make a request, retrying on connection errors and retryable
+        statuses. Raises RuntimeError with the status code if the final
+        response is not a 200.
+
+        GET requests go through the cache, if there is one, unless `cached` is
+        False. A page fetched with `stream` set still streams, and is only
+        cached once it has all been read; a page served from the cache is
+        already in memory, though reading it with `iter_content` works the
+        same."""
+        if self.cache is not None and method == 'GET' and cached:
+            return self._cached_get(url, **kwargs)
+        resp = self._send(method, url, **kwargs)
+        if resp.status_code != 200:
+            raise RuntimeError(resp.status_code)
+        return resp
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def submit(self, fn: Callable[..., R], *args, **kwargs) -> 'Future[R]':
+        """Run `fn` on the worker pool."""
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def imap(self, fn: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+        """Apply `fn` to every item on the worker pool. Results come back in
+        the same order as `items`."""
+        return self.pool.map(fn, items)
+
+    def map(self, urls: Iterable[str]) -> Iterator[requests.Response]:
+        """GET every URL on the worker pool, yielding the responses in the
+        same order as `urls`."""
+        return self.imap(self.get, urls)
@@ -1,7 +1,10 @@
 # https://www.biblical.ie/page.php?fl=NRSV/Mark
 
+from bisect import bisect_left
 import re
 
+PUNC = re.compile(r",|;|\.|\?|!")
+
 def format_chapter(raw_text, max_len = 12):
     # Remove headings
     x1 = re.sub(r"\n\n((\w| |,|')+)\n\n", "", raw_text)
@@ -32,18 +35,15 @@ def format_chapter(raw_text, max_len = 12):
 
 
 # Find the punctuation mark closest to the middle, and split.
-def split_punc(x, punc = r",|;|\.|\?|!"):
+def split_punc(x, punc = PUNC):
     mid = len(x) // 2
-    a = re.search(punc, x).start()
-    while True:
-        if not re.search(punc, x[a+1:]):
-            break
-        b = a + re.search(punc, x[a+1:]).start() + 1
-        if b < mid:
-            a = b
-            continue
-        else:
-            if b - mid < abs(a - mid):
-                a = b
-            break
+    # Find all the punctuation in one pass; the marks either side of the middle
+    # are then found by bisection.
+    ps = [p.start() for p in re.compile(punc).finditer(x)]
+    i = bisect_left(ps, mid)
+    # The last mark before the middle, or the first mark if there are none.
+    a = ps[max(i - 1, 0)]
+    # Take the first mark after the middle instead, if it's closer.
+    if 0 < i < len(ps) and ps[i] - mid < abs(a - mid):
+        a = ps[i]
     return x[0:a+1], x[a+1:]
@@ -0,0 +1,206 @@
+"""A persistent on-disk cache of HTTP responses, shared by the scrapers.
+
+Responses are stored in SQLite under a hash of the request (method, URL and
+parameters). An entry younger than the cache's TTL is served without touching
+the network; an older one is revalidated with If-None-Match/If-Modified-Since,
+so that only pages that have changed are downloaded again. The total size of
+the stored bodies is capped, evicting the least recently used entries first.
+"""
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+from dataclasses import dataclass
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import logging as log
+import requests
+
+# By default, use cached responses for 30 days before revalidating.
+TTL = 30 * 24 * 3600
+# Only these headers are worth keeping with a cached body.
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+'''
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+    fetched_at: float
+
+    def to_response(self) -> requests.Response:
+        """Rebuild a `requests.Response` that reads from the cached body."""
+        resp = requests.Response()
+        resp.url = self.url
+        resp.status_code = self.status
+        resp.headers = CaseInsensitiveDict(self.headers)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = self.body
+        resp._content_consumed = True
+        return resp
+
+
+class RecordingStream:
+    """Stands in for a streamed response's `raw` body, passing it on to the
+    caller as it's read, and handing the whole body to `done` once it has all
+    been read. A body that's only partly read is never handed on.
+    """
+
+    def __init__(self, raw: Any, done: Callable[[bytes], None]) -> None:
+        self.raw = raw
+        self.done = done
+        self.chunks: List[bytes] = []
+
+    def stream(
+        self, amt: Optional[int] = None, decode_content: Optional[bool] = None
+    ) -> Iterator[bytes]:
+        for chunk in self.raw.stream(amt, decode_content=decode_content):
+            self.chunks.append(chunk)
+            yield chunk
+        self.done(b''.join(self.chunks))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+
+class HTTPCache:
+    """Store HTTP responses in the SQLite database at `path`.
+
+    Args:
+        path (str): The database file.
+        ttl (float): Seconds an entry is used without revalidation. None
+            means entries never go stale.
+        max_bytes (int): Cap on the total size of the cached bodies.
+    """
+
+    def __init__(
+        self,
+        path: str = 'http-cache.sqlite',
+        ttl: Optional[float] = TTL,
+        max_bytes: int = 2 ** 30,
+    ) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Fetchers use the cache from their worker threads; access is
+        # serialised by the lock.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.size = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+        # How each lookup went: served from the cache, revalidated with the
+        # server, or fetched.
+        self.stats = {'hit': 0, 'revalidated': 0, 'miss': 0}
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    @staticmethod
+    def key(
+        method: str, url: str, params: Optional[Mapping[str, Any]] = None
+    ) -> str:
+        """The cache key for a request."""
+        request = [method.upper(), url, sorted((params or {}).items())]
+        return hashlib.sha256(
+            json.dumps(request, ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Look up an entry, marking it as recently used."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT url, status, headers, body, fetched_at '
+                'FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                'UPDATE responses SET accessed_at = ? WHERE key = ?',
+                (time.time(), key)
+            )
+            self.db.commit()
+        url, status, headers, body, fetched_at = row
+        return CachedResponse(url, status, json.loads(headers), body, fetched_at)
+
+    def record(self, outcome: str) -> None:
+        """Count how a lookup went, for the stats."""
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return self.ttl is None or time.time() - entry.fetched_at < self.ttl
+
+    def put(
+        self, key: str, resp: requests.Response, body: Optional[bytes] = None
+    ) -> None:
+        """Store a response, evicting old entries if over the size cap. The
+        body is read from the response, unless given."""
+        headers = {
+            k: resp.headers[k] for k in KEPT_HEADERS if k in resp.headers
+        }
+        if body is None:
+            body = resp.content
+        now = time.time()
+        with self.lock:
+            old = self.db.execute(
+                'SELECT size FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, resp.url, resp.status_code, json.dumps(headers), body,
+                 len(body), now, now)
+            )
+            self.size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self.db.commit()
+
+    def revalidated(
+        self, key: str, entry: CachedResponse, resp: requests.Response
+    ) -> None:
+        """Record that the server confirmed (with a 304) that an entry is
+        still current."""
+        # A 304 may carry updated validators.
+        for k in ('etag', 'last-modified'):
+            if k in resp.headers:
+                entry.headers[k] = resp.headers[k]
+        entry.fetched_at = time.time()
+        with self.lock:
+            self.db.execute(
+                'UPDATE responses SET headers = ?, fetched_at = ? WHERE key = ?',
+                (json.dumps(entry.headers), entry.fetched_at, key)
+            )
+            self.db.commit()
+
+    def _evict(self) -> None:
+        # Drop the least recently used entries until we're under the cap.
+        # Called with the lock held.
+        while self.size > self.max_bytes:
+            row = self.db.execute(
+                'SELECT key, size FROM responses ORDER BY accessed_at LIMIT 1'
+            ).fetchone()
+            if row is None:
+                break
+            log.debug(f'Evicting {row[0]} from the HTTP cache')
+            self.db.execute('DELETE FROM responses WHERE key = ?', (row[0],))
+            self.size -= row[1]
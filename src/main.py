@@ -1,123 +1,137 @@
-from typing import List, Dict, Tuple
-from genanki import Deck, Note, Model, Package
-import requests
+from typing import List, Tuple
+from genanki import Deck, Model
 from datetime import datetime
 import logging as log
+from deckwriter import DeckWriter, manifest_for
+from fetch import Fetcher
+from httpcache import HTTPCache, TTL
+from media import MediaFetcher
+from sparqldeck import WIKIDATA, Row, SparqlDeck, qid
 
 
 def main(args: List[str]) -> int:
-    assert len(args) == 2, "Usage: main OUTPUT"
-    out = args[1]
+    usage = "Usage: main OUTPUT [--refresh] [--incremental]"
+    assert len(args) >= 2, usage
+    out, opts = args[1], args[2:]
+    assert all(opt in ("--refresh", "--incremental") for opt in opts), usage
+    # Query results are cached between runs. With --refresh, check with
+    # Wikidata whether they have changed.
+    cache = HTTPCache(ttl=0 if "--refresh" in opts else TTL)
     # Scrape the data from Wikidata
-    data, images = scrape_wikidata()
-    # Build the deck object
-    deck = build_deck(data)
-    # Write the deck object to an .apkg file
-    write_deck(out, deck, images)
+    monarchs = monarchs_deck()
+    with Fetcher(cache=cache) as fetcher:
+        rows, images = scrape_wikidata(fetcher, monarchs)
+    log.info(f'HTTP cache: {cache.stats}')
+    # Build the deck and write it to an .apkg file. With --incremental, only
+    # the notes that changed since the last export are written.
+    write_deck(out, monarchs, rows, images, incremental="--incremental" in opts)
     log.info('Done.')
     return 0
 
 
-def download_image(filename: str, uri: str) -> str:
-    import os.path
+def image_filename(name: str, uri: str) -> str:
+    """The filename to save the image at `uri` under, for the entry called
+    `name`."""
     # Build filename with extension
     ext = uri.split('.')[-1]
-    with_ext = f'{filename}.{ext}'
-    path = '../img/' + with_ext
-    if not os.path.exists(path):
-        # Wikimedia requires descriptive headers
-        log.info(f'Downloading image for {filename}...')
-        headers = {'user-agent':
-            'moneng-anki/0.0.0 (https://github.com/kokestu/moneng-anki)'}
-        img_data = requests.get(uri+'?width=300px', headers=headers).content
-        with open(path, 'wb') as file:
-            file.write(img_data)
-    else:
-        log.info(f'Image for {filename} already present...')
-
-    return with_ext
+    return f"{name.replace(' ', '-')}.{ext}"
+
+
+def get_year(iso_date: str) -> str:
+    if iso_date:
+        return str(datetime.strptime(iso_date, '%Y-%m-%dT%H:%M:%SZ').year)
+    return 'Present'
 
 
 # Test queries at: https://query.wikidata.org/
-def scrape_wikidata() -> Tuple[List[Dict[str, str]], List[str]]:
-    # Make the query to Wikidata
-    url = 'https://query.wikidata.org/sparql'
-    query = '''
-    SELECT (?itemLabel as ?name)
-    # Get first start date
-    (min(?start) as ?start_date)
-    # Get last end date
-    (max(?end) as ?end_date)
-    # Make a list
-    (GROUP_CONCAT(DISTINCT ?replacesLabel; SEPARATOR=", ") AS ?predecessors)
-    (GROUP_CONCAT(DISTINCT ?replaced_byLabel; SEPARATOR=", ") AS ?followers)
-    # Get a random image
-    (SAMPLE(?pic) AS ?pics)
-    WHERE {
-        # Define positions "monarch of UK" and "monarch of England"
-        VALUES ?positions {wd:Q18810062 wd:Q9134365}
-        # Filter by "position held" == "monarch of UK" or "monarch of England"
-        ?item p:P39 ?statement.
-        ?statement ps:P39 ?positions.
-        # Select relevant parameters
-        OPTIONAL { ?statement pq:P580 ?start. }          # Start time
-        OPTIONAL { ?statement pq:P582 ?end. }            # End time
-        OPTIONAL { ?statement pq:P1365 ?replaces. }      # Predecessor
-        OPTIONAL { ?statement pq:P1366 ?replaced_by. }   # Successor
-        OPTIONAL { ?item wdt:P18 ?pic}                   # Image
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en".
-                                ?item rdfs:label ?itemLabel.
-                                ?replaces rdfs:label ?replacesLabel.
-                                ?replaced_by rdfs:label ?replaced_byLabel.}
-    }
-    # Group records by the monarch name
-    GROUP BY (?itemLabel)
-    ORDER BY DESC (?start)
-    '''
+MONARCHS_QUERY = '''
+SELECT ?item (?itemLabel as ?name)
+# Get first start date
+(min(?start) as ?start_date)
+# Get last end date
+(max(?end) as ?end_date)
+# Make a list
+(GROUP_CONCAT(DISTINCT ?replacesLabel; SEPARATOR=", ") AS ?predecessors)
+(GROUP_CONCAT(DISTINCT ?replaced_byLabel; SEPARATOR=", ") AS ?followers)
+# Get a random image
+(SAMPLE(?pic) AS ?pics)
+WHERE {
+    # Define positions "monarch of UK" and "monarch of England"
+    VALUES ?positions {wd:Q18810062 wd:Q9134365}
+    # Filter by "position held" == "monarch of UK" or "monarch of England"
+    ?item p:P39 ?statement.
+    ?statement ps:P39 ?positions.
+    # Select relevant parameters
+    OPTIONAL { ?statement pq:P580 ?start. }          # Start time
+    OPTIONAL { ?statement pq:P582 ?end. }            # End time
+    OPTIONAL { ?statement pq:P1365 ?replaces. }      # Predecessor
+    OPTIONAL { ?statement pq:P1366 ?replaced_by. }   # Successor
+    OPTIONAL { ?item wdt:P18 ?pic}                   # Image
+    SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en".
+                            ?item rdfs:label ?itemLabel.
+                            ?replaces rdfs:label ?replacesLabel.
+                            ?replaced_by rdfs:label ?replaced_byLabel.}
+}
+# Group records by the monarch
+GROUP BY ?item ?itemLabel
+# Most recent first. Break ties on the item, so that the results page the
+# same way every time.
+ORDER BY DESC (?start_date) ?item
+'''
+
+
+def monarchs_deck(endpoint: str = WIKIDATA) -> SparqlDeck:
+    """The monarchs deck: a note per result of the query, with the image
+    (once downloaded) as `image`."""
+    return SparqlDeck(
+        MONARCHS_QUERY,
+        make_model(),
+        fields={
+            "Monarch": "name",
+            "ReignedFrom": lambda row: get_year(row.get("start_date")),
+            "ReignedTo": lambda row: get_year(row.get("end_date")),
+            "Image": lambda row: f'<img src="{row["image"]}">',
+            "Predecessor": "predecessors",
+            "Successor": "followers",
+        },
+        # The Wikidata ID, e.g. Q9682, which stays the same when the
+        # monarch's other details are corrected.
+        guid=lambda row: qid(row["item"]),
+        endpoint=endpoint,
+    )
+
+
+def scrape_wikidata(
+    fetcher: Fetcher, monarchs: SparqlDeck
+) -> Tuple[List[Row], List[str]]:
+    """Query for the monarchs and download their images. Returns the
+    results, each with its image's filename as `image`, and the images."""
     log.info('Making Wikidata request...')
-    r = requests.get(url, params={'format': 'json', 'query': query})
-    data = r.json()['results']['bindings']
-
-    def get_value(monarch, name):
-        return monarch.get(name, {}).get('value', '')
-
-    def get_year(iso_date):
-        if iso_date:
-            return str(datetime.strptime(iso_date, '%Y-%m-%dT%H:%M:%SZ').year)
-        return 'Present'
-
-    # Collect the monarch records and image filenames
-    monarchs = []
-    images = []
-    for entry in data:
-        if get_value(entry, 'name') in [
+    # Skip the entries we don't want, and check the rest have images.
+    entries = []
+    for entry in monarchs.rows(fetcher):
+        if entry.get('name') in [
                 'Eleanor of Aquitaine',
                 ]:
             continue
-        image_uri = get_value(entry, 'pics')
-        if not image_uri:
+        if not entry.get('pics'):
             raise ValueError(f'No image for {entry}')
-        img_name = download_image(
-            get_value(entry, 'name').replace(' ', '-'),
-            get_value(entry, 'pics')
-        )
-        images.append(img_name)
-        monarch = dict(
-            Monarch=get_value(entry, 'name'),
-            ReignedFrom=get_year(get_value(entry, 'start_date')),
-            ReignedTo=get_year(get_value(entry, 'end_date')),
-            Image=f'<img src="{img_name}">',
-            Predecessor=get_value(entry, 'predecessors'),
-            Successor=get_value(entry, 'followers'),
-        )
-        monarchs.append(monarch)
-
-    return monarchs, images
-
-
-def build_deck(data: List[Dict[str, str]]) -> Deck:
+        entries.append(entry)
+
+    # Download the images concurrently. Entries that share an image share
+    # the downloaded file.
+    media = MediaFetcher('../img', fetcher, query='?width=300px')
+    filenames = media.fetch_all(
+        (image_filename(e['name'], e['pics']), e['pics']) for e in entries
+    )
+    images = list(dict.fromkeys(filenames.values()))
+    rows = [dict(e, image=filenames[e['pics']]) for e in entries]
+    return rows, images
+
+
+def make_model() -> Model:
     # Define note type
-    model = Model(
+    return Model(
         7499558394,  # Unique model ID randomly generated
         'Monarch',
         fields=[
@@ -170,36 +184,27 @@ def build_deck(data: List[Dict[str, str]]) -> Deck:
         }
         """,   # custom styling
     )
+
+
+def write_deck(
+    out: str,
+    monarchs: SparqlDeck,
+    rows: List[Row],
+    images: List[str],
+    incremental: bool = False,
+) -> None:
     # Create deck
     deck = Deck(
         4276883578,  # Unique deck ID randomly generated
         'Monarchs of England'
     )
-    # Add notes
-    for d in data:
-        deck.add_note(make_note(d, model))
-    # Return
-    return deck
-
-
-def make_note(datum: Dict[str, str], model: Model) -> Note:
-    my_note = Note(
-        model=model,
-        fields=[
-            datum.get("Monarch"),
-            datum.get("ReignedFrom"),
-            datum.get("ReignedTo"),
-            datum.get("Image"),
-            datum.get("Predecessor"),
-            datum.get("Successor"),
-        ]
-    )
-    return my_note
-
-def write_deck(out: str, deck: Deck, images: List[str]) -> None:
-    package = Package(deck)
-    package.media_files = [f'../img/{img}' for img in images]
-    package.write_to_file(out)
+    manifest = manifest_for(out) if incremental else None
+    with DeckWriter(out, deck, manifest=manifest) as writer:
+        # Identical images are only stored once, under the first one's name.
+        names = {img: writer.add_media(f'../img/{img}') for img in images}
+        writer.add_notes(monarchs.notes(
+            dict(row, image=names[row['image']]) for row in rows
+        ))
 
 if __name__ == "__main__":
     import sys
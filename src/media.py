@@ -0,0 +1,128 @@
+"""Download media files (such as the monarchs' portraits) concurrently.
+
+Files are streamed to disk through a temporary file in the same directory,
+which is only renamed into place once the whole file has arrived, so a crash
+mid-download never leaves a truncated file behind. A manifest records the
+SHA-256 and size of every file downloaded; a file only counts as already
+downloaded if it still matches its manifest entry.
+"""
+from typing import Dict, Iterable, List, Tuple
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import logging as log
+
+from fetch import Fetcher
+
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaFetcher:
+    """Download files into `directory` over `fetcher`'s pool.
+
+    Args:
+        directory (str): Where to put the files, and their manifest.
+        fetcher (Fetcher): Makes the requests.
+        query (str): Appended to each URI, e.g. to ask for a thumbnail.
+    """
+
+    def __init__(self, directory: str, fetcher: Fetcher, query: str = '') -> None:
+        self.directory = directory
+        self.fetcher = fetcher
+        self.query = query
+        self.manifest_path = os.path.join(directory, MANIFEST)
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def _save_manifest(self) -> None:
+        # Write the manifest atomically too.
+        with self.lock:
+            manifest = json.dumps(self.manifest, indent=1, sort_keys=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(manifest)
+        os.replace(tmp, self.manifest_path)
+
+    def is_present(self, filename: str, uri: str) -> bool:
+        """Whether the file from `uri` is already downloaded intact."""
+        entry = self.manifest.get(filename)
+        path = os.path.join(self.directory, filename)
+        return (
+            entry is not None
+            and entry['uri'] == uri
+            and os.path.exists(path)
+            and os.path.getsize(path) == entry['size']
+            and file_digest(path) == entry['sha256']
+        )
+
+    def _download(self, item: Tuple[str, str]) -> str:
+        filename, uri = item
+        if self.is_present(filename, uri):
+            log.info(f'{filename} already present...')
+            return filename
+        log.info(f'Downloading {filename}...')
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f, \
+                    self.fetcher.get(
+                        uri + self.query, stream=True, cached=False
+                    ) as resp:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                expected = resp.headers.get('content-length')
+                # Content-Length is the size on the wire, so only check it
+                # when the body wasn't compressed.
+                if (expected is not None and 'content-encoding' not in resp.headers
+                        and int(expected) != size):
+                    raise RuntimeError(
+                        f'{uri}: got {size} of {expected} bytes'
+                    )
+            os.replace(tmp, os.path.join(self.directory, filename))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self.lock:
+            self.manifest[filename] = {
+                'uri': uri, 'sha256': digest.hexdigest(), 'size': size
+            }
+        return filename
+
+    def fetch_all(self, items: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        """Make sure every (filename, uri) is downloaded. A URI shared between
+        several items is only downloaded once, under the first filename it
+        came with.
+
+        Returns:
+            Dict[str, str]: The filename each URI was saved under.
+        """
+        filenames: Dict[str, str] = {}
+        for filename, uri in items:
+            filenames.setdefault(uri, filename)
+        todo: List[Tuple[str, str]] = [(f, u) for (u, f) in filenames.items()]
+        try:
+            for _ in self.fetcher.imap(self._download, todo):
+                pass
+        finally:
+            # Record whatever finished, even if something failed.
+            self._save_manifest()
+        return filenames
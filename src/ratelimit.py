@@ -0,0 +1,214 @@
+"""An adaptive rate limiter, shared by everything that makes HTTP requests.
+
+Each host has a token bucket, refilled at that host's current rate. When the
+host answers 429 or 503, the rate is halved, and no more requests go to it
+until the time its Retry-After header asks for has passed. Successful
+responses raise the rate again a little at a time, so a long scrape settles
+just under the fastest rate each service allows. Until a host first throttles
+us, the rate doubles every second instead, like TCP's slow start. Neither
+ever takes it past the host's ceiling: the fewest requests a second that any
+of its clients allows (e.g. the 10/s asked of cs.wiktionary.org), if they set
+one.
+
+`LIMITER` is shared by every `Fetcher` in the process, so separate clients of
+the same host back off together. Threads call `wait`; async code awaits
+`asyncio.sleep(LIMITER.delay(host))` instead.
+"""
+from typing import Dict, Optional
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import threading
+import time
+import logging as log
+
+# Responses that mean the server wants us to slow down.
+THROTTLE_STATUSES = {429, 503}
+
+
+def host_of(url: str) -> str:
+    """The host (and port) a URL is for."""
+    return urlsplit(url).netloc or url
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """How many seconds a Retry-After header (a number of seconds or an HTTP
+    date) asks us to wait, or None if it's missing or unreadable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class Bucket:
+    """The rate limit for one host. A rate of None means no limit, apart from
+    the pauses the host asks for. The rate never climbs past `max_rate`, if
+    given."""
+
+    def __init__(
+        self, rate: Optional[float], burst: int, max_rate: Optional[float] = None
+    ) -> None:
+        if rate and max_rate:
+            rate = min(rate, max_rate)
+        self.rate = rate
+        self.max_rate = max_rate
+        self.burst = burst
+        # When the bucket will next be empty, if nothing else is taken: the
+        # "theoretical arrival time" of the generic cell rate algorithm.
+        self.next_time = 0.0
+        # No requests start before this time.
+        self.paused_until = 0.0
+        # Whether the host has yet to throttle us.
+        self.slow_start = True
+
+    def reserve(self, now: float) -> float:
+        """Take a token, returning the time the request may start."""
+        interval = 1 / self.rate if self.rate else 0.0
+        start = max(
+            now,
+            self.next_time - (self.burst - 1) * interval,
+            self.paused_until,
+        )
+        self.next_time = max(self.next_time, start) + interval
+        return start
+
+    def saturated(self, now: float) -> bool:
+        # Requests are queuing up at the current rate.
+        return self.next_time >= now
+
+
+class AdaptiveLimiter:
+    """Per-host token buckets that slow down when the host says so, and speed
+    back up while it doesn't.
+
+    Args:
+        burst (int): How many requests may start at once after a quiet spell.
+        min_rate (float): Never slow down below this many requests a second.
+        max_rate (float): Never speed up beyond this for any host, or None
+            for no limit beyond each host's own.
+        increase (float): How fast the rate climbs back, in requests per
+            second gained per second of successful requests.
+        decrease (float): What the rate is multiplied by on each throttled
+            response.
+    """
+
+    def __init__(
+        self,
+        burst: int = 1,
+        min_rate: float = 0.1,
+        max_rate: Optional[float] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+    ) -> None:
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.buckets: Dict[str, Bucket] = {}
+        self.lock = threading.Lock()
+
+    def _bucket(
+        self,
+        host: str,
+        rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+    ) -> Bucket:
+        # The first client of a host sets its starting rate. Later clients
+        # can only tighten it: the ceiling is the lowest any of them asks
+        # for, and a host without a limit yet takes the first one given.
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = Bucket(rate, self.burst, max_rate)
+            return bucket
+        if max_rate:
+            bucket.max_rate = min(bucket.max_rate or max_rate, max_rate)
+        if bucket.rate is None:
+            bucket.rate = rate
+        if bucket.rate and bucket.max_rate:
+            bucket.rate = min(bucket.rate, bucket.max_rate)
+        return bucket
+
+    def rate(self, host: str) -> Optional[float]:
+        """The current rate for the host, in requests per second, or None if
+        it has no limit or hasn't been seen yet."""
+        with self.lock:
+            bucket = self.buckets.get(host)
+            return bucket.rate if bucket else None
+
+    def delay(
+        self,
+        host: str,
+        rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+    ) -> float:
+        """Reserve a slot for a request to `host`, returning how many seconds
+        to wait before sending it. `rate` is the starting rate, used if the
+        host has no limit yet, and `max_rate` a ceiling, which lowers the
+        host's if it's lower."""
+        with self.lock:
+            now = time.monotonic()
+            return self._bucket(host, rate, max_rate).reserve(now) - now
+
+    def wait(
+        self,
+        host: str,
+        rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+    ) -> None:
+        """Block until a request to `host` may be sent."""
+        # Reserve under the lock (in `delay`), but sleep outside of it so that
+        # other threads can reserve the slots after ours.
+        delay = self.delay(host, rate, max_rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def succeeded(self, host: str) -> None:
+        """Note a response that wasn't throttled."""
+        with self.lock:
+            bucket = self._bucket(host)
+            # Only speed up while the limit is what's holding requests back;
+            # otherwise the rate would climb far past what's actually sent.
+            if bucket.rate and bucket.saturated(time.monotonic()):
+                # About `rate` requests succeed a second, so this doubles the
+                # rate every second in slow start, and otherwise adds
+                # `increase` to it.
+                if bucket.slow_start:
+                    rate = bucket.rate + 1
+                else:
+                    rate = bucket.rate + self.increase / bucket.rate
+                for ceiling in (self.max_rate, bucket.max_rate):
+                    if ceiling:
+                        rate = min(rate, ceiling)
+                bucket.rate = rate
+
+    def throttled(self, host: str, retry_after: Optional[float] = None) -> None:
+        """Note a throttled response, slowing down and pausing requests to
+        the host for `retry_after` seconds, if given."""
+        with self.lock:
+            bucket = self._bucket(host)
+            bucket.slow_start = False
+            now = time.monotonic()
+            # Requests sent before an earlier throttled response are likely
+            # to be throttled too; slow down once for all of them.
+            if bucket.rate and now >= bucket.paused_until:
+                bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            if retry_after:
+                bucket.paused_until = max(
+                    bucket.paused_until, now + retry_after
+                )
+            rate = f'{bucket.rate:.2f}/s' if bucket.rate else 'unlimited'
+            log.info(
+                f'{host} is throttling requests; rate now {rate}, '
+                f'pausing {retry_after or 0:.1f}s'
+            )
+
+
+# Shared by every client in the process.
+LIMITER = AdaptiveLimiter()
@@ -0,0 +1,188 @@
+"""Decks defined by a SPARQL query, and how to fill each note from a result.
+
+A `SparqlDeck` pages through its query's results with LIMIT and OFFSET, with
+several pages in flight at once, instead of asking for everything in one
+request (which, for a big query, the query service gives up on after 60s).
+Each page's JSON is parsed as it streams in, one binding at a time, and the
+results come out in order, page by page, with only a few pages held at once,
+so a deck of any size can be streamed to a `DeckWriter`.
+
+Paging needs the results in a stable order, so the query should end with an
+ORDER BY that ties are broken in, e.g. on the item.
+"""
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Mapping, Optional, Union
+from collections import deque
+from concurrent.futures import Future
+import codecs
+import json
+import re
+import logging as log
+from genanki import Deck, Model, Note, guid_for
+
+from deckwriter import DeckWriter, manifest_for
+from fetch import Fetcher
+
+WIKIDATA = 'https://query.wikidata.org/sparql'
+# Each result, as the value of each variable bound in it.
+Row = Dict[str, str]
+# A note field is a variable's value, or made from the whole result.
+Field = Union[str, Callable[[Row], str]]
+
+WHITESPACE = re.compile(r'[\s,]*')
+
+
+def iter_bindings(chunks: Iterable[bytes]) -> Iterator[Row]:
+    """Parse SPARQL JSON results a chunk at a time, yielding each binding as
+    soon as it's complete."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    json_decoder = json.JSONDecoder()
+    buffer = ''
+    # Are we in the bindings yet? Done with them?
+    in_bindings = done = False
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if not in_bindings:
+            start = buffer.find('"bindings"')
+            start = buffer.find('[', start) if start >= 0 else -1
+            if start < 0:
+                continue
+            buffer = buffer[start + 1:]
+            in_bindings = True
+        pos = 0
+        while True:
+            # Skip the separators between bindings.
+            pos = WHITESPACE.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                done = True
+                break
+            try:
+                binding, pos = json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The rest of the binding is still to come.
+                break
+            yield {name: value['value'] for (name, value) in binding.items()}
+        if done:
+            return
+        buffer = buffer[pos:]
+    raise ValueError('SPARQL results ended part way through')
+
+
+class SparqlDeck:
+    """A deck's notes, made from the results of a SPARQL query.
+
+    Args:
+        query (str): The SELECT query, without a LIMIT or OFFSET.
+        model (Model): The note type.
+        fields (Mapping[str, Field]): How to fill each of the model's fields:
+            the name of a variable, or a function of the result.
+        guid (Field): What identifies a note's subject, e.g. the item's QID,
+            so that its note keeps the same GUID when the details change.
+        endpoint (str): The SPARQL endpoint.
+        page_size (int): Results per request.
+        in_flight (int): How many pages to request at once.
+    """
+
+    def __init__(
+        self,
+        query: str,
+        model: Model,
+        fields: Mapping[str, Field],
+        guid: Field,
+        endpoint: str = WIKIDATA,
+        page_size: int = 1000,
+        in_flight: int = 4,
+    ) -> None:
+        names = [field['name'] for field in model.fields]
+        assert list(fields) == names, f'Fields must be given for {names}'
+        self.query = query
+        self.model = model
+        self.fields = fields
+        self.guid = guid
+        self.endpoint = endpoint
+        self.page_size = page_size
+        self.in_flight = in_flight
+
+    def _page(self, fetcher: Fetcher, offset: Optional[int]) -> List[Row]:
+        query = self.query
+        if offset is not None:
+            query += f'\nLIMIT {self.page_size} OFFSET {offset}'
+        # Allow for the query service's own 60s timeout.
+        resp = fetcher.get(
+            self.endpoint,
+            params={'format': 'json', 'query': query},
+            headers={'accept': 'application/sparql-results+json'},
+            timeout=90,
+            stream=True,
+        )
+        with resp:
+            chunks = resp.iter_content(64 * 1024)
+            rows = list(iter_bindings(chunks))
+            # Read the little that's left after the bindings, so that the
+            # page is cached, and the connection can be used again.
+            for _ in chunks:
+                pass
+            return rows
+
+    def rows(self, fetcher: Fetcher, paged: bool = True) -> Iterator[Row]:
+        """The query's results, in order. Pages are requested on the
+        fetcher's pool, `in_flight` at a time, until one comes back short.
+        Unless `paged`, the results are all asked for in one request."""
+        if not paged:
+            yield from self._page(fetcher, None)
+            return
+        pending: Deque['Future[List[Row]]'] = deque()
+        offset = 0
+        last_page = False
+        pages = 0
+        while True:
+            while not last_page and len(pending) < self.in_flight:
+                pending.append(fetcher.submit(self._page, fetcher, offset))
+                offset += self.page_size
+            if not pending:
+                break
+            page = pending.popleft().result()
+            pages += 1
+            if len(page) < self.page_size:
+                # That was the last of the results. Pages already asked for
+                # after it come back empty.
+                last_page = True
+            yield from page
+        log.info(f'Read {pages} pages of results from {self.endpoint}')
+
+    def note(self, row: Row) -> Note:
+        return Note(
+            model=self.model,
+            guid=guid_for(field_value(self.guid, row)),
+            fields=[field_value(field, row) for field in self.fields.values()],
+        )
+
+    def notes(self, rows: Iterable[Row]) -> Iterator[Note]:
+        for row in rows:
+            yield self.note(row)
+
+    def write(
+        self,
+        out: str,
+        deck: Deck,
+        fetcher: Fetcher,
+        incremental: bool = False,
+    ) -> None:
+        """Query for the deck and write it to the .apkg at `out`, a page at
+        a time. With `incremental`, only the notes that changed since the last
+        incremental export are written."""
+        manifest = manifest_for(out) if incremental else None
+        with DeckWriter(out, deck, manifest=manifest) as writer:
+            writer.add_notes(self.notes(self.rows(fetcher)))
+
+
+def field_value(field: Field, row: Row) -> str:
+    """A field's value for a result. Variables the result doesn't bind are
+    empty."""
+    if callable(field):
+        return field(row)
+    return row.get(field, '')
+
+
+def qid(uri: str) -> str:
+    """The ID, e.g. Q9682, of the Wikidata item with this URI."""
+    return uri.rsplit('/', 1)[-1]
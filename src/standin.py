@@ -0,0 +1,359 @@
+"""Local HTTP stand-ins for the services the scrapers talk to, so that
+throughput can be benchmarked offline.
+
+Each stand-in is a threaded HTTP server on localhost that answers from a
+handler function after an artificial delay, and counts the requests it gets.
+Responses that carry an ETag are revalidated like the real services do: a
+request whose If-None-Match matches gets an empty 304. A stand-in given a
+`max_rate` throttles like they do too, answering requests beyond that rate
+with a 429 and a Retry-After header.
+
+`wiktionary_dump` writes the same made-up Wiktionary as an XML dump, for
+reading the words offline, and `sparql` stands in for the Wikidata query
+service.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+import bz2
+import hashlib
+import json
+import re
+import threading
+import time
+
+# A handler gets the method, the path (with query string) and the request body,
+# and returns the status, extra headers and response body.
+Handler = Callable[[str, str, bytes], Tuple[int, Dict[str, str], bytes]]
+
+
+class StandIn:
+    """Serve `handler` on a free localhost port from a background thread.
+
+    Args:
+        handler (Handler): Builds the response for each request.
+        latency (float): Seconds to wait before answering each request.
+        max_rate (float): Requests per second to allow (in bursts of up to a
+            second's worth) before throttling, or None to never throttle.
+        retry_after (int): Seconds to ask throttled clients to wait.
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        latency: float = 0.0,
+        max_rate: Optional[float] = None,
+        retry_after: int = 1,
+    ) -> None:
+        self.handler = handler
+        self.latency = latency
+        self.max_rate = max_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        # Connections opened by clients, to check that they're reused.
+        self.connections = 0
+        # A token bucket holding a second's worth of requests.
+        self.tokens = max_rate or 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        standin = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            # Keep connections alive, like the real services do.
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _respond(self) -> None:
+                length = int(self.headers.get('content-length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with standin.lock:
+                    standin.requests += 1
+                    allowed = standin._take_token()
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if allowed:
+                    status, headers, content = standin.handler(
+                        self.command, self.path, body
+                    )
+                else:
+                    status, content = 429, b'Too Many Requests'
+                    headers = {'retry-after': str(standin.retry_after)}
+                etag = headers.get('etag')
+                if etag and self.headers.get('if-none-match') == etag:
+                    status, content = 304, b''
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('content-length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def handle(self) -> None:
+                with standin.lock:
+                    standin.connections += 1
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client hung up, maybe part way through a response.
+                    pass
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    def _take_token(self) -> bool:
+        # Called under the lock.
+        if not self.max_rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(
+            self.max_rate, self.tokens + (now - self.updated) * self.max_rate
+        )
+        self.updated = now
+        if self.tokens < 1:
+            self.throttled += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def __enter__(self) -> 'StandIn':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def wiktionary_word_page(
+    word: str, n_defs: int = 3, other_size: int = 200
+) -> str:
+    """A page laid out like a cs.wiktionary word page, with a Czech section
+    between sections for other languages. `other_size` sets the length of
+    those other sections."""
+    defs = ''.join(
+        f'<li>{word} význam {i}<ul>'
+        f'<li>Věta s <b>{word}</b> číslo {i}.</li>'
+        f'<li>Delší věta, ve které je slovo <b>{word}</b> použito {i}.</li>'
+        '</ul></li>'
+        for i in range(n_defs)
+    )
+    trans = ''.join(
+        '<div class="translations"><ul><li>angličtina: '
+        f'<span class="translation-item" lang="en">{word}-en-{i}</span>'
+        '</li></ul></div>'
+        for i in range(n_defs)
+    )
+    other = '<p>' + 'Text v jiném jazyce. ' * other_size + '</p>'
+    return (
+        '<html><body>'
+        '<h2><span class="mw-headline" id="angličtina">angličtina</span></h2>'
+        f'{other}'
+        '<h2><span class="mw-headline" id="čeština">čeština</span></h2>'
+        '<h3><span class="mw-headline" id="podstatné_jméno">podstatné jméno'
+        '</span></h3>'
+        '<h4><span class="mw-headline" id="význam">význam</span></h4>'
+        f'<ol>{defs}</ol>'
+        '<h4><span class="mw-headline" id="překlady">překlady</span></h4>'
+        f'{trans}'
+        '<h2><span class="mw-headline" id="němčina">němčina</span></h2>'
+        f'{other}'
+        '</body></html>'
+    )
+
+
+def wiktionary_list_page(words) -> str:
+    """A page laid out like a page of the ČNK SYN2005 frequency list."""
+    links = ' '.join(
+        f'<a href="/wiki/{quote(w)}" title="{w}">{w}</a>' for w in words
+    )
+    return f'<html><body><h5>1-{len(words)}</h5><p>{links}</p></body></html>'
+
+
+def wiktionary(
+    n_words: int = 100,
+    latency: float = 0.0,
+    n_defs: int = 3,
+    other_size: int = 200,
+    max_rate: Optional[float] = None,
+) -> StandIn:
+    """A stand-in for cs.wiktionary.org, with a frequency list of `n_words`
+    made-up words, each with its own word page. A list page like
+    ".../1001-2000" lists the words of those ranks. Throttles beyond
+    `max_rate` requests a second, if given."""
+
+    def handler(method: str, path: str, body: bytes):
+        path = unquote(urlsplit(path).path)
+        if 'Frekvenční_seznam' in path:
+            first, last = path.rsplit('/', 1)[-1].split('-')
+            content = wiktionary_list_page([
+                f'slovo{i}' for i in range(int(first) - 1, min(int(last), n_words))
+            ])
+        else:
+            content = wiktionary_word_page(
+                path.rsplit('/', 1)[-1], n_defs, other_size
+            )
+        content = content.encode('utf-8')
+        headers = {
+            'content-type': 'text/html; charset=utf-8',
+            'etag': f'"{hashlib.sha1(content).hexdigest()}"',
+        }
+        return 200, headers, content
+
+    return StandIn(handler, latency, max_rate)
+
+
+def wiktionary_word_wikitext(
+    word: str, n_defs: int = 3, other_size: int = 200
+) -> str:
+    """The wikitext of a page like `wiktionary_word_page`, with the same
+    definitions, examples and translations."""
+    defs = ''.join(
+        f'# {word} význam {i}\n'
+        f"#* ''Věta s '''{word}''' číslo {i}.''\n"
+        f"#* ''Delší věta, ve které je slovo '''{word}''' použito {i}.''\n"
+        for i in range(n_defs)
+    )
+    trans = ''.join(
+        f'# {{{{Překlady\n| význam = {word} význam {i}\n'
+        f'| en = {{{{P|en|{word}-en-{i}}}}}\n| de = {{{{P|de|{word}-de-{i}}}}}\n}}}}\n'
+        for i in range(n_defs)
+    )
+    other = 'Text v jiném jazyce. ' * other_size + '\n'
+    return (
+        f'== angličtina ==\n{other}'
+        '== čeština ==\n'
+        '=== podstatné jméno ===\n'
+        "* ''rod mužský neživotný''\n"
+        f'==== význam ====\n{defs}'
+        f'==== překlady ====\n{trans}'
+        f'== němčina ==\n{other}'
+    )
+
+
+def wiktionary_dump(
+    path: str,
+    n_words: int = 100,
+    n_defs: int = 3,
+    other_size: int = 200,
+    page_size: int = 1000,
+) -> None:
+    """Write a pages-articles dump of the stand-in Wiktionary to `path`,
+    compressed with bz2 if it ends in .bz2: a frequency list of `n_words`
+    made-up words, in pages of `page_size`, and a page for each word."""
+
+    def page(title: str, text: str) -> str:
+        return (
+            f'  <page>\n    <title>{escape(title)}</title>\n    <ns>0</ns>\n'
+            f'    <revision>\n      <text xml:space="preserve">{escape(text)}'
+            '</text>\n    </revision>\n  </page>\n'
+        )
+
+    opener = bz2.open if path.endswith('.bz2') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('<mediawiki xml:lang="cs">\n')
+        for start in range(0, n_words, page_size):
+            name = f'{start + 1}-{start + page_size}'
+            links = ' '.join(
+                f'[[slovo{i}]]' for i in range(start, min(start + page_size, n_words))
+            )
+            f.write(page(
+                f'Příloha:Frekvenční seznam (čeština)/ČNK SYN2005/{name}',
+                f'Slova podle četnosti.\n===== {name} =====\n{links}\n',
+            ))
+        for i in range(n_words):
+            f.write(page(
+                f'slovo{i}', wiktionary_word_wikitext(f'slovo{i}', n_defs, other_size)
+            ))
+        f.write('</mediawiki>\n')
+
+
+def sparql(
+    rows: List[Dict[str, str]],
+    latency: float = 0.0,
+    max_rows: Optional[int] = None,
+) -> StandIn:
+    """A stand-in for a SPARQL endpoint like the Wikidata query service,
+    whatever the query, answering with `rows` (each the value of each
+    variable), or the part of them the query's LIMIT and OFFSET ask for.
+    Values that look like URIs are bound as URIs. A query that would give
+    more than `max_rows` results fails with a 500 instead, like a query
+    that runs past the real service's timeout."""
+    variables = list(dict.fromkeys(v for row in rows for v in row))
+    paging = re.compile(r'LIMIT\s+(\d+)\s+OFFSET\s+(\d+)\s*$', re.I)
+
+    def binding(value: str) -> Dict[str, str]:
+        kind = 'uri' if value.startswith('http') else 'literal'
+        return {'type': kind, 'value': value}
+
+    def handler(method: str, path: str, body: bytes):
+        query = parse_qs(urlsplit(path).query).get('query', [''])[0]
+        m = paging.search(query)
+        if m:
+            limit, offset = int(m.group(1)), int(m.group(2))
+            page = rows[offset:offset + limit]
+        else:
+            page = rows
+        if max_rows is not None and len(page) > max_rows:
+            return 500, {}, b'java.util.concurrent.TimeoutException'
+        content = json.dumps({
+            'head': {'vars': variables},
+            'results': {'bindings': [
+                {k: binding(v) for (k, v) in row.items()} for row in page
+            ]},
+        })
+        headers = {'content-type': 'application/sparql-results+json'}
+        return 200, headers, content.encode('utf-8')
+
+    return StandIn(handler, latency)
+
+
+def heads_of_state(n: int) -> List[Dict[str, str]]:
+    """`n` made-up heads of state, as the results of a query for them."""
+    return [
+        {
+            'item': f'http://www.wikidata.org/entity/Q{i + 1}',
+            'name': f'Head of State {i + 1}',
+            'country': f'Country {i % 200}',
+            'start_date': f'{1800 + i % 220}-01-01T00:00:00Z',
+            **({'end_date': f'{1805 + i % 220}-01-01T00:00:00Z'}
+               if i % 10 else {}),
+        }
+        for i in range(n)
+    ]
+
+
+def deepl(latency: float = 0.0) -> StandIn:
+    """A stand-in for the DeepL translate endpoint, with the real API's limits
+    on the number of texts and the size of a request. Each text is
+    "translated" by tagging it with [en]. Counts the texts translated as well
+    as the requests."""
+
+    def handler(method: str, path: str, body: bytes):
+        if len(body) > 128 * 1024:
+            return 413, {}, b'Request Entity Too Large'
+        texts = parse_qs(body.decode('utf-8')).get('text', [])
+        if not texts or len(texts) > 50:
+            return 400, {}, b'Bad request'
+        with server.lock:
+            server.texts += len(texts)
+        content = json.dumps({'translations': [
+            {'detected_source_language': 'CS', 'text': f'[en] {text}'}
+            for text in texts
+        ]})
+        return 200, {'content-type': 'application/json'}, content.encode()
+
+    server = StandIn(handler, latency)
+    server.texts = 0
+    return server